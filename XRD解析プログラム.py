@@ -9,6 +9,12 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.backends.backend_tkagg import NavigationToolbar2Tk
 import data_analyzer
+import perf_monitor
+import redraw_scheduler
+import fringe_analysis
+import rsm
+import thumbnail_cache
+from cursor_readout import BlittedCursor
 import json
 
 class XRDPlotter(tk.Frame):
@@ -55,7 +61,9 @@ class XRDPlotter(tk.Frame):
         self.lc_input_d_var, self.lc_h_var, self.lc_k_var, self.lc_l_var = tk.StringVar(), tk.StringVar(value="1"), tk.StringVar(value="0"), tk.StringVar(value="0")
         self.lc_result_var = tk.StringVar(value="a = ?")
         self.export_width_var, self.export_height_var, self.export_format_var = tk.StringVar(value="6"), tk.StringVar(value="6"), tk.StringVar(value="png")
+        self.grid_rows_var, self.grid_cols_var, self.grid_source_var = tk.StringVar(value="2"), tk.StringVar(value="2"), tk.StringVar(value="datasets")
         self.selected_substance_var = tk.StringVar()
+        self.cursor_readout_var = tk.BooleanVar(value=True)
         
         # List of tk variables to be saved/loaded
         self._savable_vars = [
@@ -68,9 +76,11 @@ class XRDPlotter(tk.Frame):
             'show_minor_xticks_var', 'xminor_tick_spacing_var', 'peak_label_fontsize_var',
             'peak_label_offset_var', 'peak_label_y_var', 'match_math_font_var', 'd_spacing_input_2theta_var', 'lc_input_d_var',
             'lc_h_var', 'lc_k_var', 'lc_l_var', 'export_width_var', 'export_height_var',
-            'export_format_var',
+            'export_format_var', 'grid_rows_var', 'grid_cols_var', 'grid_source_var', 'cursor_readout_var',
             'peak_detection_enabled_var', 'peak_detection_height_var',
-            'peak_detection_prominence_var', 'peak_detection_width_var'
+            'peak_detection_prominence_var', 'peak_detection_width_var',
+            'peak_detection_smoothing_var', 'peak_detection_window_var', 'peak_detection_second_derivative_var',
+            'fringe_center_var', 'fringe_window_var', 'fringe_refine_var'
         ]
         
         # Analysis settings
@@ -78,8 +88,15 @@ class XRDPlotter(tk.Frame):
         self.peak_detection_height_var = tk.DoubleVar(value=10)
         self.peak_detection_prominence_var = tk.DoubleVar(value=10)
         self.peak_detection_width_var = tk.DoubleVar(value=1.0)
+        self.peak_detection_smoothing_var = tk.StringVar(value="none") # "none", "savgol" or "gaussian"
+        self.peak_detection_window_var = tk.IntVar(value=11)
+        self.peak_detection_second_derivative_var = tk.BooleanVar(value=False)
+        self.fringe_center_var, self.fringe_window_var = tk.StringVar(value="43.1"), tk.DoubleVar(value=2.0)
+        self.fringe_refine_var, self.fringe_result_var = tk.BooleanVar(value=True), tk.StringVar(value="t = ?")
 
         self._debounce_job, self.file_data, self.parsed_data = None, {}, {}
+        self._redraw_scheduler, self._worker_poll_job = redraw_scheduler.RedrawScheduler(), None
+        self._thumbnail_cache, self._scan_browsers = None, set()
         
         # Register validation command
         self.vcmd_float = (self.register(self._validate_float), '%P')
@@ -89,6 +106,7 @@ class XRDPlotter(tk.Frame):
 
         self.create_menu()
         self.create_widgets()
+        self.master.protocol("WM_DELETE_WINDOW", self.quit_app)
 
     def create_menu(self):
         self.menubar = tk.Menu(self.master)
@@ -97,12 +115,23 @@ class XRDPlotter(tk.Frame):
         file_menu = tk.Menu(self.menubar, tearoff=0)
         self.menubar.add_cascade(label="ファイル", menu=file_menu)
 
+        file_menu.add_command(label="スキャンブラウザ...", command=self.open_scan_browser)
+        file_menu.add_separator()
         file_menu.add_command(label="設定を読み込む...", command=self.load_settings)
         file_menu.add_command(label="設定を保存...", command=self.save_settings)
         file_menu.add_separator()
         file_menu.add_command(label="グラフを画像として保存...", command=self.save_figure)
         file_menu.add_separator()
-        file_menu.add_command(label="終了", command=self.master.quit)
+        file_menu.add_command(label="終了", command=self.quit_app)
+
+        tools_menu = tk.Menu(self.menubar, tearoff=0)
+        self.menubar.add_cascade(label="ツール", menu=tools_menu)
+        tools_menu.add_command(label="逆格子マップ (RSM) を開く...", command=self.open_rsm_window)
+        tools_menu.add_separator()
+        self.perf_enabled_var = tk.BooleanVar(value=perf_monitor.is_enabled())
+        tools_menu.add_checkbutton(label="再描画の処理時間を計測 (ログ出力)", variable=self.perf_enabled_var, command=lambda: perf_monitor.set_enabled(self.perf_enabled_var.get()))
+        tools_menu.add_command(label="計測結果を表示...", command=self.show_perf_summary)
+        tools_menu.add_command(label="次の10回の再描画をプロファイル...", command=self.profile_next_redraws)
 
     def create_widgets(self):
         main_pane = tk.PanedWindow(self, orient=tk.HORIZONTAL, sashrelief=tk.RAISED, sashwidth=5)
@@ -124,6 +153,8 @@ class XRDPlotter(tk.Frame):
         plot_panel = tk.Frame(main_pane); main_pane.add(plot_panel, stretch="always")
         self.canvas = FigureCanvasTkAgg(self.fig, master=plot_panel); self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
         toolbar = NavigationToolbar2Tk(self.canvas, plot_panel); toolbar.update()
+        self.cursor = BlittedCursor(self.canvas, self.ax, on_click=self._on_cursor_click)
+        self.cursor_readout_var.trace_add("write", lambda *args: self.cursor.set_active(self.cursor_readout_var.get()))
         
         self._toggle_spacing_widget(); self._toggle_minor_xticks_widgets(); self.update_plot()
 
@@ -226,6 +257,7 @@ class XRDPlotter(tk.Frame):
         tk.Label(d_spacing_frame, text="定数: X線=Co Kα1 (λ=1.78897 Å), n=1").grid(row=1, column=0, columnspan=3, sticky="w", padx=5)
         tk.Label(d_spacing_frame, text="2θ (degree):").grid(row=2, column=0, sticky="w", padx=5, pady=5); d_input_entry = tk.Entry(d_spacing_frame, textvariable=self.d_spacing_input_2theta_var); d_input_entry.grid(row=2, column=1, sticky="ew", padx=5); tk.Button(d_spacing_frame, text="計算", command=self.calculate_d_spacing).grid(row=2, column=2, padx=5)
         tk.Label(d_spacing_frame, textvariable=self.d_spacing_result_var, relief="sunken").grid(row=3, column=0, columnspan=3, sticky="ew", padx=5, pady=5); d_input_entry.bind("<Return>", self.calculate_d_spacing)
+        tk.Checkbutton(d_spacing_frame, text="グラフ上のカーソル位置の d値・Q を表示 (クリックで入力)", variable=self.cursor_readout_var).grid(row=4, column=0, columnspan=3, sticky="w", padx=5)
         
         # Lattice constant tool
         lc_frame = tk.LabelFrame(analysis_frame, text="格子定数計算ツール (立方晶のみ)"); lc_frame.grid(row=1, column=0, sticky="ew", pady=5); lc_frame.columnconfigure(1, weight=1)
@@ -245,6 +277,20 @@ class XRDPlotter(tk.Frame):
         ttk.Spinbox(peak_frame, textvariable=self.peak_detection_prominence_var, from_=0, to=1e9, increment=10, command=self.schedule_update).grid(row=2, column=1, sticky="ew", padx=5, pady=2)
         tk.Label(peak_frame, text="最小幅:").grid(row=3, column=0, sticky="w", padx=5, pady=2)
         ttk.Spinbox(peak_frame, textvariable=self.peak_detection_width_var, from_=0, to=100, increment=0.5, command=self.schedule_update).grid(row=3, column=1, sticky="ew", padx=5, pady=2)
+        tk.Label(peak_frame, text="平滑化:").grid(row=4, column=0, sticky="w", padx=5, pady=2)
+        smoothing_combo = ttk.Combobox(peak_frame, textvariable=self.peak_detection_smoothing_var, values=list(data_analyzer.SMOOTHING_METHODS), state="readonly"); smoothing_combo.grid(row=4, column=1, sticky="ew", padx=5, pady=2); smoothing_combo.bind("<<ComboboxSelected>>", self.schedule_update)
+        tk.Label(peak_frame, text="平滑化の窓幅 (点):").grid(row=5, column=0, sticky="w", padx=5, pady=2)
+        ttk.Spinbox(peak_frame, textvariable=self.peak_detection_window_var, from_=5, to=501, increment=2, command=self.schedule_update).grid(row=5, column=1, sticky="ew", padx=5, pady=2)
+        tk.Checkbutton(peak_frame, text="2次微分でピーク候補を検出 (肩ピーク用、平滑化なしなら savgol)", variable=self.peak_detection_second_derivative_var, command=self.schedule_update).grid(row=6, column=0, columnspan=2, sticky="w", padx=5)
+
+        # Film thickness from Laue fringes
+        fringe_frame = tk.LabelFrame(analysis_frame, text="膜厚解析 (ラウエフリンジ)"); fringe_frame.grid(row=3, column=0, sticky="ew", pady=5); fringe_frame.columnconfigure(1, weight=1)
+        tk.Label(fringe_frame, text="式: t = 2π / Δq,  q = 4π sin(θ) / λ").grid(row=0, column=0, columnspan=2, sticky="w", padx=5)
+        tk.Label(fringe_frame, text="膜ピーク 2θ (degree):").grid(row=1, column=0, sticky="w", padx=5, pady=2); tk.Entry(fringe_frame, textvariable=self.fringe_center_var).grid(row=1, column=1, sticky="ew", padx=5, pady=2)
+        tk.Label(fringe_frame, text="解析範囲 ± (degree):").grid(row=2, column=0, sticky="w", padx=5, pady=2); ttk.Spinbox(fringe_frame, textvariable=self.fringe_window_var, from_=0.5, to=10, increment=0.5).grid(row=2, column=1, sticky="ew", padx=5, pady=2)
+        tk.Checkbutton(fringe_frame, text="モデルフィットで精密化", variable=self.fringe_refine_var).grid(row=3, column=0, sticky="w", padx=5)
+        tk.Button(fringe_frame, text="全ファイルで計算", command=self.calculate_film_thickness).grid(row=3, column=1, sticky="e", padx=5, pady=2)
+        tk.Label(fringe_frame, textvariable=self.fringe_result_var, relief="sunken", justify="left", anchor="w").grid(row=4, column=0, columnspan=2, sticky="ew", padx=5, pady=5)
 
     def build_export_tab(self, tab):
         export_frame = tk.LabelFrame(tab, text="画像ファイルとして保存"); export_frame.pack(fill="x", padx=10, pady=10); export_frame.columnconfigure(1, weight=1)
@@ -259,6 +305,14 @@ class XRDPlotter(tk.Frame):
         tk.Button(button_frame, text="プレビュー", command=self.preview_figure).grid(row=0, column=0, sticky="ew", padx=(0,2))
         tk.Button(button_frame, text="グラフを保存", command=self.save_figure, font=("", 10, "bold")).grid(row=0, column=1, sticky="ew", padx=(2,0))
 
+        grid_frame = tk.LabelFrame(tab, text="グリッド出力 (複数パネル)"); grid_frame.pack(fill="x", padx=10, pady=(0, 10)); grid_frame.columnconfigure(1, weight=1)
+        tk.Label(grid_frame, text="行数:").grid(row=0, column=0, sticky="w", padx=5, pady=2); tk.Entry(grid_frame, textvariable=self.grid_rows_var).grid(row=0, column=1, sticky="ew", padx=5, pady=2)
+        tk.Label(grid_frame, text="列数:").grid(row=1, column=0, sticky="w", padx=5, pady=2); tk.Entry(grid_frame, textvariable=self.grid_cols_var).grid(row=1, column=1, sticky="ew", padx=5, pady=2)
+        tk.Radiobutton(grid_frame, text="読み込んだデータごと (現在の設定)", variable=self.grid_source_var, value="datasets").grid(row=2, column=0, columnspan=2, sticky="w", padx=5)
+        tk.Radiobutton(grid_frame, text="設定ファイルごと (複数選択)", variable=self.grid_source_var, value="settings").grid(row=3, column=0, columnspan=2, sticky="w", padx=5)
+        tk.Label(grid_frame, text="※ 幅・高さは図全体のサイズとして使います", fg="gray").grid(row=4, column=0, columnspan=2, sticky="w", padx=5)
+        tk.Button(grid_frame, text="グリッドで保存", command=self.save_grid_figure).grid(row=5, column=0, columnspan=2, sticky="ew", padx=5, pady=(5, 5))
+
 
     def _toggle_spacing_widget(self, *args):
         if self.stack_plots_var.get(): self.spacing_label.grid(); self.spacing_entry.grid()
@@ -351,7 +405,10 @@ class XRDPlotter(tk.Frame):
             'enabled': self.peak_detection_enabled_var.get(),
             'min_height': self.peak_detection_height_var.get(),
             'min_prominence': self.peak_detection_prominence_var.get(),
-            'min_width': self.peak_detection_width_var.get()
+            'min_width': self.peak_detection_width_var.get(),
+            'smoothing': self.peak_detection_smoothing_var.get(),
+            'smoothing_window': self.peak_detection_window_var.get(),
+            'use_second_derivative': self.peak_detection_second_derivative_var.get()
         }
         
         return {
@@ -362,31 +419,72 @@ class XRDPlotter(tk.Frame):
         }
 
     def update_plot(self):
-        settings = self._get_current_plot_settings()
+        self._debounce_job = None
+        scheduler = self._redraw_scheduler
+        with perf_monitor.span('settings'):
+            settings = self._get_current_plot_settings()
         if not settings:
+            # 入力途中や不正な値の場合は、表示中のグラフをそのまま残す
+            if scheduler.committed is not None: return
             self.ax.clear()
             self.ax.text(0.5, 0.5, "ファイルを選択するか、設定を確認してください", ha='center', va='center', transform=self.ax.transAxes)
             self.canvas.draw()
             return
 
         if not settings['plot_data_full']:
+            scheduler.reset()
             self.ax.clear()
             self.ax.text(0.5, 0.5, "ファイルを選択してください", ha='center', va='center', transform=self.ax.transAxes)
             self.canvas.draw()
             return
 
+        change, fp = scheduler.classify(settings)
+        if change is None: return # 表示中のものと同じ。描画コストや計測には含めない
+        prepared = scheduler.cached_prepared(fp) if change != redraw_scheduler.LAYOUT else None
+        if change != redraw_scheduler.LAYOUT and prepared is None and scheduler.is_heavy(settings):
+            # 大きなデータはワーカーで再計算し、終わったら最新の設定で描き直す
+            scheduler.submit(settings, fp)
+            if self._worker_poll_job is None: self._worker_poll_job = self.master.after(20, self._poll_redraw_worker)
+            return
+
+        with perf_monitor.redraw(), perf_monitor.span('total'), scheduler.timer(change):
+            self._redraw_plot(settings, change, fp, prepared)
+
+    def _redraw_plot(self, settings, change, fp, prepared):
+        scheduler = self._redraw_scheduler
+        if change == redraw_scheduler.LAYOUT:
+            self.ax.set_xlim(*settings['x_range'])
+            with perf_monitor.span('canvas.draw'):
+                self.canvas.draw()
+            scheduler.commit(fp)
+            return
+
+        if prepared is None:
+            with perf_monitor.span('prepare'):
+                prepared = scheduler.prepare(settings, fp)
+
         match_math_font = settings['appearance'].get('match_math_font', False)
         rc_params = {'mathtext.default': 'regular'} if match_math_font else {}
         
         with plt.rc_context(rc_params):
             self.ax.clear()
-            error_message = data_analyzer.draw_plot(ax=self.ax, **settings)
+            error_message = data_analyzer.draw_plot(ax=self.ax, prepared=prepared, **settings)
             if error_message: messagebox.showinfo("情報", error_message)
             self.fig.subplots_adjust(left=0.1, right=0.95, top=0.95, bottom=0.15)
-            self.canvas.draw()
+            with perf_monitor.span('canvas.draw'):
+                self.canvas.draw()
+        scheduler.commit(fp)
+
+    def _poll_redraw_worker(self):
+        self._worker_poll_job = None
+        if self._redraw_scheduler.poll(): self.update_plot()
+        elif self._redraw_scheduler.is_pending(): self._worker_poll_job = self.master.after(20, self._poll_redraw_worker)
         
     def select_files(self):
         filepaths = filedialog.askopenfilenames(title="XRDファイルを選択", filetypes=[("RAS files", "*.ras"), ("All files", "*.*")])
+        self.add_files(filepaths)
+
+    def add_files(self, filepaths):
         if filepaths:
             for fp in filepaths:
                 if fp not in self.file_data:
@@ -397,6 +495,60 @@ class XRDPlotter(tk.Frame):
             if not self.file_listbox.curselection(): self.file_listbox.selection_set(tk.END); self.on_file_select(None)
             self.schedule_update()
 
+    def open_scan_browser(self):
+        directory = filedialog.askdirectory(title="RAS ファイルのあるフォルダを選択", parent=self.master)
+        if not directory: return
+        filepaths = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith('.ras'))
+        if not filepaths: messagebox.showinfo("情報", "RAS ファイルが見つかりません。", parent=self.master); return
+        if self._thumbnail_cache is None: self._thumbnail_cache = thumbnail_cache.ThumbnailCache()
+
+        window = tk.Toplevel(self.master); window.title(f"スキャンブラウザ - {directory}"); window.geometry("520x640")
+        self._scan_browsers.add(window)
+        width, height = self._thumbnail_cache.size
+        ttk.Style(window).configure("Thumbnail.Treeview", rowheight=height + 4)
+        tree_frame = tk.Frame(window); tree_frame.pack(fill=tk.BOTH, expand=True)
+        tree = ttk.Treeview(tree_frame, columns=("name",), style="Thumbnail.Treeview", selectmode="extended")
+        tree.heading("#0", text="強度 (log)"); tree.column("#0", width=width + 30, stretch=False)
+        tree.heading("name", text="ファイル名"); tree.column("name", width=300)
+        scrollbar = tk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=tree.yview); tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side="left", fill=tk.BOTH, expand=True); scrollbar.pack(side="right", fill="y")
+
+        # サムネイルはワーカーで生成 (キャッシュ済みならディスクから読むだけ) し、UI スレッドでは PhotoImage を作るだけ
+        placeholder = tk.PhotoImage(width=width, height=height)
+        images, pending = {'': placeholder}, {}
+        for fp in filepaths:
+            tree.insert("", tk.END, iid=fp, image=placeholder, values=(os.path.basename(fp),))
+            pending[fp] = self._thumbnail_cache.submit(fp)
+        window.thumbnail_images = images # PhotoImage が破棄されないようにウィンドウに保持する
+
+        def poll():
+            if not window.winfo_exists(): return
+            for fp, future in list(pending.items())[:200]:
+                if not future.done(): continue
+                del pending[fp]
+                if future.cancelled(): continue
+                data = future.result()
+                if data: images[fp] = tk.PhotoImage(master=window, data=data, format="ppm"); tree.item(fp, image=images[fp])
+            if pending: window.after(50, poll)
+        def on_destroy(event):
+            # 閉じ方によらず (閉じるボタン・親ウィンドウの破棄など) 未処理の生成を取り消し、
+            # 開いているブラウザがなくなればキューごとワーカーを止める
+            if event.widget is not window: return
+            for future in pending.values(): future.cancel()
+            self._scan_browsers.discard(window)
+            if not self._scan_browsers and self._thumbnail_cache is not None: self._thumbnail_cache.shutdown()
+        window.bind("<Destroy>", on_destroy)
+        window.after(50, poll)
+
+        def add_selected(*args): self.add_files(tree.selection())
+        tree.bind("<Double-1>", add_selected)
+        tk.Button(window, text="選択したファイルをプロットに追加", command=add_selected).pack(fill="x", padx=5, pady=5)
+
+    def quit_app(self):
+        # キューに残ったサムネイル生成があると、インタープリタの終了がその完了まで待たされるので先に止める
+        if self._thumbnail_cache is not None: self._thumbnail_cache.shutdown()
+        self.master.quit()
+
     def remove_selected_file(self):
         selected_indices = self.file_listbox.curselection()
         if not selected_indices: return
@@ -523,6 +675,70 @@ class XRDPlotter(tk.Frame):
             except Exception as e:
                 messagebox.showerror("エラー", f"ファイルの保存中にエラーが発生しました:\n{e}", parent=self.master)
 
+    def _grid_panels_from_settings_files(self):
+        # 設定ファイル1つを1パネルにする。読み込み済みのスキャンは再解析しない
+        settings_paths = filedialog.askopenfilenames(title="パネルにする設定ファイルを選択", filetypes=[("JSON files", "*.json"), ("All files", "*.*")], parent=self.master)
+        if not settings_paths: return None
+        panels, parsed = [], dict(self.parsed_data)
+        for path in settings_paths:
+            with open(path, 'r', encoding='utf-8') as f: saved = json.load(f)
+            for fp in saved.get('files', {}).get('filepaths', []):
+                if fp not in parsed and os.path.exists(fp):
+                    angles, intensities = data_analyzer.parse_ras_file(fp)
+                    if angles is not None and intensities is not None: parsed[fp] = (angles, intensities)
+            panel = data_analyzer.plot_settings_from_saved(saved, parsed)
+            if not panel['plot_data_full']: raise ValueError(f"データファイルが見つかりません: {os.path.basename(path)}")
+            panels.append(panel)
+        return panels
+
+    def save_grid_figure(self):
+        # 複数パネルを1つの Figure にまとめ、1回の savefig で書き出す
+        try:
+            width = float(self.export_width_var.get()); height = float(self.export_height_var.get())
+            nrows = int(self.grid_rows_var.get()); ncols = int(self.grid_cols_var.get())
+            if width <= 0 or height <= 0 or nrows <= 0 or ncols <= 0: raise ValueError
+        except ValueError:
+            messagebox.showerror("エラー", "幅・高さ・行数・列数の値が不正です。", parent=self.master)
+            return
+
+        by_dataset = self.grid_source_var.get() == "datasets"
+        try:
+            if by_dataset:
+                settings = self._get_current_plot_settings()
+                if not settings or not settings['plot_data_full']:
+                    messagebox.showwarning("警告", "保存対象のデータがありません。", parent=self.master)
+                    return
+                # 縦並びなしで表示中なら、画面の描画で計算済みの結果をそのまま使う
+                prepared = self._redraw_scheduler.cached_prepared(redraw_scheduler.fingerprint(dict(settings, stack=False)))
+                panels = data_analyzer.split_dataset_panels(settings, prepared)
+            else:
+                panels = self._grid_panels_from_settings_files()
+                if panels is None: return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            messagebox.showerror("エラー", f"パネルの準備中にエラーが発生しました:\n{e}", parent=self.master)
+            return
+        if len(panels) > nrows * ncols:
+            messagebox.showerror("エラー", f"パネル数 ({len(panels)}) が {nrows}×{ncols} のグリッドに収まりません。", parent=self.master)
+            return
+
+        filepath = filedialog.asksaveasfilename(title="グリッドを保存", defaultextension=f".{self.export_format_var.get()}", filetypes=[(f"{self.export_format_var.get().upper()} files", f"*.{self.export_format_var.get()}"), ("All files", "*.*")], parent=self.master)
+        if not filepath: return
+
+        save_dpi = 300
+        fig = Figure(figsize=(width, height), dpi=save_dpi)
+        # 設定ファイルごとのパネルは X 範囲が同じ場合だけ X 軸を共有する。Y 範囲はデータごとの場合だけ共通
+        sharex = len({tuple(p['x_range']) for p in panels}) == 1
+        rc_params = {'mathtext.default': 'regular'} if panels[0]['appearance'].get('match_math_font', False) else {}
+        with plt.rc_context(rc_params):
+            with perf_monitor.span('grid_export'):
+                data_analyzer.draw_plot_grid(fig, panels, nrows, ncols, sharex=sharex, sharey=by_dataset)
+                try:
+                    fig.savefig(filepath, dpi=save_dpi, bbox_inches='tight', transparent=True)
+                except Exception as e:
+                    messagebox.showerror("エラー", f"ファイルの保存中にエラーが発生しました:\n{e}", parent=self.master)
+                    return
+        messagebox.showinfo("成功", f"グリッド ({len(panels)} パネル) を保存しました:\n{filepath}", parent=self.master)
+
     def on_file_select(self, event):
         selected_indices = self.file_listbox.curselection()
         if not selected_indices: self.legend_name_entry.config(state="disabled"); self.legend_name_var.set(""); return
@@ -539,16 +755,61 @@ class XRDPlotter(tk.Frame):
 
     def schedule_update(self, *args):
         if self._debounce_job: self.master.after_cancel(self._debounce_job)
-        self._debounce_job = self.master.after(250, self.update_plot)
+        self._debounce_job = self.master.after(self._redraw_scheduler.debounce_ms(), self.update_plot)
+
+    def open_rsm_window(self):
+        filepaths = filedialog.askopenfilenames(title="RSM の RAS ファイルを選択", filetypes=[("RAS files", "*.ras"), ("All files", "*.*")], parent=self.master)
+        if not filepaths: return
+        try:
+            rsm_data = rsm.load_rsm(filepaths)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("エラー", f"RSM の読み込みに失敗しました:\n{e}", parent=self.master); return
+        qx, qz = rsm.to_q_space(rsm_data['omega'], rsm_data['two_theta'])
+        grid, qx_edges, qz_edges = rsm.grid_rsm(qx, qz, rsm_data['intensity'])
+
+        window = tk.Toplevel(self.master)
+        window.title(f"逆格子マップ - {rsm_data['label']} ({rsm_data['segments']} セグメント)")
+        style_var = tk.StringVar(value="image")
+        fig = Figure(figsize=(6, 5))
+        canvas = FigureCanvasTkAgg(fig, master=window)
+        def redraw(*args):
+            fig.clear(); ax = fig.add_subplot(111)
+            mappable = rsm.draw_rsm(ax, grid, qx_edges, qz_edges, style=style_var.get())
+            if mappable is not None: fig.colorbar(mappable, ax=ax, label="Intensity (cps)")
+            canvas.draw()
+        option_frame = tk.Frame(window); option_frame.pack(side=tk.TOP, fill=tk.X)
+        tk.Radiobutton(option_frame, text="イメージ", variable=style_var, value="image", command=redraw).pack(side="left")
+        tk.Radiobutton(option_frame, text="等高線", variable=style_var, value="contour", command=redraw).pack(side="left")
+        canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        toolbar = NavigationToolbar2Tk(canvas, window); toolbar.update()
+        redraw()
+
+    def show_perf_summary(self):
+        window = tk.Toplevel(self.master)
+        window.title("再描画の計測結果")
+        text = tk.Text(window, font=("Courier", 10), width=100, height=20)
+        text.pack(fill=tk.BOTH, expand=True)
+        text.insert("1.0", perf_monitor.format_summary())
+        text.config(state="disabled")
+
+    def profile_next_redraws(self):
+        filepath = filedialog.asksaveasfilename(title="プロファイルの保存先", initialfile="redraw.prof", defaultextension=".prof", filetypes=[("cProfile stats", "*.prof"), ("All files", "*.*")], parent=self.master)
+        if not filepath: return
+        perf_monitor.profile_next(10, filepath)
+        # 変更なしの更新は描画されず計測対象にもならないので、最初の1回は全体を描き直させる
+        self._redraw_scheduler.commit(None)
+        self.schedule_update()
 
     def calculate_d_spacing(self, *args):
         try:
             two_theta_deg = float(self.d_spacing_input_2theta_var.get())
             if two_theta_deg <= 0 or two_theta_deg >= 180: self.d_spacing_result_var.set("エラー: 2θは0-180の範囲で入力"); return
-            theta_rad = math.radians(two_theta_deg / 2.0); lambda_coka1 = 1.78897
-            d = lambda_coka1 / (2 * math.sin(theta_rad)); self.d_spacing_result_var.set(f"{d:.5f} Å")
+            d = float(data_analyzer.calculate_d_spacing(two_theta_deg)); self.d_spacing_result_var.set(f"{d:.5f} Å")
         except (ValueError, TypeError): self.d_spacing_result_var.set("エラー: 有効な数値を入力してください")
 
+    def _on_cursor_click(self, two_theta):
+        self.d_spacing_input_2theta_var.set(f"{two_theta:.3f}"); self.calculate_d_spacing()
+
     def copy_d_spacing(self, *args):
         try:
             result_str = self.d_spacing_result_var.get(); d_value = result_str.split(" ")[0]
@@ -562,6 +823,25 @@ class XRDPlotter(tk.Frame):
             a = d * math.sqrt(h**2 + k**2 + l**2); self.lc_result_var.set(f"a = {a:.5f} Å")
         except (ValueError, TypeError): self.lc_result_var.set("エラー: 有効な数値を入力してください")
 
+    def calculate_film_thickness(self, *args):
+        try:
+            center = float(self.fringe_center_var.get()); half_width = float(self.fringe_window_var.get())
+            if not 0 < center < 180 or half_width <= 0: raise ValueError
+        except (ValueError, TypeError, tk.TclError): self.fringe_result_var.set("エラー: 有効な数値を入力してください"); return
+        filepaths = [fp for fp in self.file_listbox.get(0, tk.END) if fp in self.parsed_data]
+        if not filepaths: self.fringe_result_var.set("エラー: ファイルが読み込まれていません"); return
+
+        results = fringe_analysis.estimate_thickness_series({fp: self.parsed_data[fp] for fp in filepaths}, center, half_width=half_width, refine=self.fringe_refine_var.get())
+        lines = []
+        for fp in filepaths:
+            r = results.get(fp)
+            if r is None: lines.append(f"{self.file_data.get(fp, fp)}: 範囲内のデータ不足"); continue
+            t = r['thickness_refined'] if r['thickness_refined'] is not None else r['thickness']
+            line = f"{self.file_data.get(fp, fp)}: t = {t / 10:.2f} nm (2θ={r['two_theta_peak']:.2f}°, power={r['power']:.2f})"
+            if not r['reliable']: line += f" ※ 窓内のフリンジが {r['n_periods']:.1f} 周期のみで信頼できません (窓を広げてください)"
+            lines.append(line)
+        self.fringe_result_var.set("\n".join(lines))
+
     def _validate_float(self, P):
         if P == "" or P == "-":
             return True
@@ -0,0 +1,202 @@
+"""パース・描画・ピーク検出・エクスポートの処理時間を計測するベンチマーク.
+
+合成した RAS ファイルを使い、各ステージを個別に計測して JSON で出力する。
+ディスプレイ不要 (Agg バックエンド) で実行できる。
+
+    python benchmark.py --scans 1 10 100 --points 1000 20000 -o bench.json
+    python benchmark.py --compare old.json new.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Dict, Any, Callable
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy as np
+
+import data_analyzer
+
+STAGES = ['parse', 'draw', 'peaks', 'peaks_smoothed', 'export', 'settings']
+
+# GUI の初期値と同じ外観設定
+DEFAULT_APPEARANCE = {
+    'xlabel': '2θ/ω (degree)', 'ylabel': 'Log Intensity (arb. Units)', 'axis_label_fontsize': 20.0, 'tick_label_fontsize': 16.0,
+    'legend_fontsize': 10.0, 'linewidth': 1.0, 'tick_direction': 'in', 'threshold_handling': 'clip',
+    'xaxis_major_tick_spacing': 5.0, 'show_grid': False, 'ytop_padding_factor': 1.5,
+    'hide_major_xtick_labels': False, 'show_minor_xticks': True, 'xminor_tick_spacing': 1.0,
+    'peak_label_fontsize': 9.0, 'peak_label_offset': 0.4, 'peak_label_y': 0.9, 'match_math_font': False,
+    'legend_loc': 'best', 'legend_frame': True, 'legend_bgcolor': 'white', 'legend_italic': False,
+    'yscale': 'log', 'font_family': 'sans-serif'
+}
+DEFAULT_PEAK_DETECTION = {'enabled': True, 'min_height': 10.0, 'min_prominence': 10.0, 'min_width': 1.0}
+SMOOTHED_PEAK_DETECTION = dict(DEFAULT_PEAK_DETECTION, smoothing='savgol', smoothing_window=11, use_second_derivative=True)
+
+
+def make_synthetic_scan(n_points: int, n_peaks: int, rng: np.random.Generator, x_range=(20.0, 130.0)):
+    angles = np.linspace(x_range[0], x_range[1], n_points)
+    background = 20.0 * np.exp(-(angles - x_range[0]) / 40.0) + 5.0
+    intensities = background.copy()
+    centers = rng.uniform(x_range[0] + 2, x_range[1] - 2, n_peaks)
+    heights = 10 ** rng.uniform(2, 5, n_peaks)
+    widths = rng.uniform(0.05, 0.3, n_peaks)
+    for c, h, w in zip(centers, heights, widths):
+        intensities += h * np.exp(-0.5 * ((angles - c) / w) ** 2)
+    intensities = rng.poisson(intensities).astype(float)
+    return angles, intensities
+
+
+def write_ras_file(filepath: str, angles: np.ndarray, intensities: np.ndarray):
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write('*RAS_DATA_START\n*RAS_HEADER_START\n*FILE_COMMENT "synthetic benchmark scan"\n*RAS_HEADER_END\n*RAS_INT_START\n')
+        np.savetxt(f, np.column_stack([angles, intensities, np.ones_like(angles)]), fmt=['%.4f', '%.1f', '%.4f'])
+        f.write('*RAS_INT_END\n*RAS_DATA_END\n')
+
+
+def _time_call(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return {'min': min(samples), 'median': statistics.median(samples), 'mean': statistics.mean(samples)}
+
+
+def run_case(workdir: str, n_scans: int, n_points: int, n_peaks: int, repeat: int, seed: int = 0) -> Dict[str, Any]:
+    rng = np.random.default_rng(seed)
+    filepaths = []
+    for i in range(n_scans):
+        fp = os.path.join(workdir, f"scan_{n_scans}_{n_points}_{i:04d}.ras")
+        write_ras_file(fp, *make_synthetic_scan(n_points, n_peaks, rng))
+        filepaths.append(fp)
+
+    parsed = {}
+    def parse():
+        for fp in filepaths: parsed[fp] = data_analyzer.parse_ras_file(fp)
+    timings = {'parse': _time_call(parse, repeat)}
+
+    plot_data_full = [{'label': os.path.basename(fp), 'angles': parsed[fp][0], 'intensities': parsed[fp][1]} for fp in filepaths]
+    plot_kwargs = {
+        'plot_data_full': plot_data_full, 'threshold': 1.0, 'x_range': (30.0, 130.0), 'reference_peaks': [],
+        'show_legend': n_scans <= 20, 'stack': False, 'spacing': 3.0, 'appearance': DEFAULT_APPEARANCE,
+        'peak_detection_settings': {'enabled': False}
+    }
+
+    fig = Figure(figsize=(6, 4))
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    def draw():
+        data_analyzer.draw_plot(ax=ax, **plot_kwargs)
+        canvas.draw()
+    timings['draw'] = _time_call(draw, repeat)
+
+    # GUI と同じ prepare_plot_data 経由のピーク検出 (描画は含まない)。平滑化ありの場合は
+    # キャッシュを毎回空にして、平滑化・2次微分の計算も含めて計測する
+    def peaks(peak_settings):
+        data_analyzer.clear_smoothing_cache()
+        data_analyzer.prepare_plot_data(plot_data_full, 1.0, False, 3.0, DEFAULT_APPEARANCE, peak_settings)
+    timings['peaks'] = _time_call(lambda: peaks(DEFAULT_PEAK_DETECTION), repeat)
+    timings['peaks_smoothed'] = _time_call(lambda: peaks(SMOOTHED_PEAK_DETECTION), repeat)
+
+    def export():
+        export_fig = Figure(figsize=(6, 6), dpi=300)
+        FigureCanvasAgg(export_fig)
+        data_analyzer.draw_plot(ax=export_fig.add_subplot(111), **plot_kwargs)
+        export_fig.subplots_adjust(left=0.1, right=0.95, top=0.95, bottom=0.1)
+        export_fig.savefig(io.BytesIO(), format='png', dpi=300, bbox_inches='tight', transparent=True)
+    timings['export'] = _time_call(export, repeat)
+
+    # save_settings と同じスキーマで書き出し、読み込み直す
+    saved = {
+        'files': {'filepaths': filepaths, 'file_data': {fp: os.path.basename(fp) for fp in filepaths}},
+        'variables': {'xmin_var': '30', 'xmax_var': '130', 'threshold_var': '1', 'show_legend_var': True},
+        'reference_peaks': [{'name': '', 'angle': '', 'visible': False, 'color': '#000000', 'style': '--'} for _ in range(10)]
+    }
+    settings_path = os.path.join(workdir, 'settings.json')
+    def settings():
+        with open(settings_path, 'w', encoding='utf-8') as f: json.dump(saved, f, indent=4, ensure_ascii=False)
+        with open(settings_path, 'r', encoding='utf-8') as f: loaded = json.load(f)
+        parsed_loaded = {fp: data_analyzer.parse_ras_file(fp) for fp in loaded['files']['filepaths']}
+        data_analyzer.plot_settings_from_saved(loaded, parsed_loaded)
+    timings['settings'] = _time_call(settings, repeat)
+
+    for fp in filepaths: os.remove(fp)
+    return {'scans': n_scans, 'points': n_points, 'peaks_per_scan': n_peaks, 'repeat': repeat, 'timings': timings}
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run_benchmarks(scans: List[int], points: List[int], peaks: int, repeat: int) -> Dict[str, Any]:
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_scans in scans:
+            for n_points in points:
+                case = run_case(workdir, n_scans, n_points, peaks, repeat)
+                results.append(case)
+                summary = ", ".join(f"{s}={case['timings'][s]['median'] * 1e3:.1f}ms" for s in STAGES)
+                print(f"scans={n_scans:5d} points={n_points:7d}: {summary}", file=sys.stderr)
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'git_revision': _git_revision(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'matplotlib': matplotlib.__version__,
+            'platform': platform.platform()
+        },
+        'results': results
+    }
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    base_cases = {(r['scans'], r['points'], r['peaks_per_scan']): r for r in base['results']}
+    lines = []
+    for r in new['results']:
+        old = base_cases.get((r['scans'], r['points'], r['peaks_per_scan']))
+        if old is None: continue
+        ratios = []
+        for s in STAGES:
+            if s in r['timings'] and s in old['timings'] and old['timings'][s]['median'] > 0:
+                ratios.append(f"{s}={r['timings'][s]['median'] / old['timings'][s]['median']:.2f}x")
+        lines.append(f"scans={r['scans']:5d} points={r['points']:7d}: " + ", ".join(ratios))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="XRD 解析処理のベンチマーク")
+    parser.add_argument('--scans', type=int, nargs='+', default=[1, 10, 100], help="スキャン数 (1-1000)")
+    parser.add_argument('--points', type=int, nargs='+', default=[1000, 20000], help="1スキャンあたりの点数 (1k-200k)")
+    parser.add_argument('--peaks', type=int, default=10, help="1スキャンあたりのピーク数")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', help="結果を書き出す JSON ファイル (省略時は標準出力)")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="2つの結果 JSON の中央値を比較する")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], 'r', encoding='utf-8') as f: base = json.load(f)
+        with open(args.compare[1], 'r', encoding='utf-8') as f: new = json.load(f)
+        print("\n".join(compare(base, new)))
+        return
+
+    report = run_benchmarks(args.scans, args.points, args.peaks, args.repeat)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f: f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
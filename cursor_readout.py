@@ -0,0 +1,109 @@
+"""メインキャンバス上の十字カーソルと 2θ / 強度 / d値 / Q の読み取り表示.
+
+カーソルは animated なアーティストとして描き、draw_event ごとに保存した背景に
+blit するだけなので、マウス移動で canvas.draw() は発生しない。
+最近傍点の探索は各データ線の (昇順の) 角度配列に対する np.searchsorted で行う。
+"""
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+from matplotlib.lines import Line2D
+
+import data_analyzer
+
+
+class BlittedCursor:
+    def __init__(self, canvas, ax, on_click: Optional[Callable[[float], None]] = None):
+        self.canvas, self.ax = canvas, ax
+        self.on_click = on_click
+        self.active = True
+        self.background = None
+        self._datasets: List[Tuple[str, np.ndarray, np.ndarray, float]] = [] # (label, 昇順の角度, 表示上の強度, 縦並び倍率)
+        self._artists = None
+        canvas.mpl_connect('draw_event', self._on_draw)
+        canvas.mpl_connect('motion_notify_event', self._on_move)
+        canvas.mpl_connect('axes_leave_event', self._on_leave)
+        canvas.mpl_connect('button_press_event', self._on_press)
+
+    def set_active(self, active: bool):
+        self.active = active
+        if not active: self._clear()
+
+    def _create_artists(self):
+        # ax.clear() でアーティストは外れるので、描画のたびに必要なら作り直す
+        ax = self.ax
+        vline = Line2D([0, 0], [0, 1], transform=ax.get_xaxis_transform(), color='gray', linewidth=0.8, linestyle=':', animated=True)
+        hline = Line2D([0, 1], [0, 0], transform=ax.get_yaxis_transform(), color='gray', linewidth=0.8, linestyle=':', animated=True)
+        marker = Line2D([], [], marker='o', markersize=5, markerfacecolor='none', markeredgecolor='black', linestyle='none', animated=True)
+        for artist in (vline, hline, marker): ax.add_artist(artist)
+        text = ax.text(0.01, 0.98, "", transform=ax.transAxes, va='top', ha='left', fontsize=9, family='monospace', animated=True,
+                       bbox=dict(boxstyle='round', facecolor='white', alpha=0.8, edgecolor='gray'))
+        self._artists = (vline, hline, marker, text)
+
+    def _on_draw(self, event):
+        if self._artists is None or self._artists[0] not in self.ax.get_children(): self._create_artists()
+        self._datasets = []
+        for line in self.ax.get_lines():
+            if line.get_gid() != data_analyzer.DATA_LINE_GID: continue
+            x = np.asarray(line.get_xdata(), dtype=float); y = np.asarray(line.get_ydata(), dtype=float)
+            if x.size == 0: continue
+            if np.any(x[1:] < x[:-1]):
+                order = np.argsort(x, kind='stable'); x, y = x[order], y[order]
+            self._datasets.append((line.get_label(), x, y, float(getattr(line, data_analyzer.DATA_LINE_SCALE_ATTR, 1.0))))
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+
+    def _nearest_point(self, x: float, y_px: float):
+        # 各データセットで x に最も近い点を O(log n) で求め、画面上の y が最も近いデータセットを選ぶ
+        candidates = []
+        for label, xs, ys, scale in self._datasets:
+            i = int(np.searchsorted(xs, x))
+            if i >= xs.size or (i > 0 and x - xs[i - 1] < xs[i] - x): i -= 1
+            if np.isfinite(ys[i]): candidates.append((label, xs[i], ys[i], scale))
+        if not candidates: return None
+        points = self.ax.transData.transform(np.array([(c[1], c[2]) for c in candidates]))
+        with np.errstate(invalid='ignore'):
+            distances = np.abs(points[:, 1] - y_px)
+        if np.all(np.isnan(distances)): return None
+        return candidates[int(np.nanargmin(distances))]
+
+    def _on_move(self, event):
+        if not self.active or self.background is None or self._artists is None: return
+        if event.inaxes is not self.ax or event.xdata is None:
+            self._clear(); return
+        if self.canvas.toolbar is not None and self.canvas.toolbar.mode: return
+
+        vline, hline, marker, text = self._artists
+        two_theta = event.xdata
+        nearest = self._nearest_point(two_theta, event.y)
+        vline.set_xdata([two_theta, two_theta])
+        lines = [f"2θ = {two_theta:8.3f}°"]
+        if nearest is not None:
+            label, px, py, scale = nearest
+            hline.set_ydata([py, py]); hline.set_visible(True)
+            marker.set_data([px], [py]); marker.set_visible(True)
+            # 縦並び表示では倍率を掛ける前の強度を表示する
+            lines.append(f"I  = {py / scale:.4g} ({label})")
+        else:
+            hline.set_visible(False); marker.set_visible(False)
+        if 0 < two_theta < 180:
+            lines.append(f"d  = {float(data_analyzer.calculate_d_spacing(two_theta)):.5f} Å")
+            lines.append(f"Q  = {float(data_analyzer.calculate_q(two_theta)):.5f} Å⁻¹")
+        text.set_text("\n".join(lines))
+
+        self.canvas.restore_region(self.background)
+        for artist in self._artists:
+            if artist.get_visible(): self.ax.draw_artist(artist)
+        self.canvas.blit(self.ax.bbox)
+
+    def _on_leave(self, event):
+        self._clear()
+
+    def _on_press(self, event):
+        if not self.active or self.on_click is None or event.inaxes is not self.ax or event.xdata is None: return
+        if self.canvas.toolbar is not None and self.canvas.toolbar.mode: return
+        if event.button == 1: self.on_click(event.xdata)
+
+    def _clear(self):
+        if self.background is None: return
+        self.canvas.restore_region(self.background)
+        self.canvas.blit(self.ax.bbox)
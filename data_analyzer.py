@@ -1,9 +1,29 @@
 import os
+import threading
+from collections import OrderedDict
 import matplotlib.pyplot as plt
+import matplotlib.lines as mlines
 from matplotlib.ticker import MultipleLocator, NullLocator
 import numpy as np
 from typing import List, Tuple, Dict, Optional, Any
-from scipy.signal import find_peaks
+from scipy.signal import find_peaks, peak_widths, savgol_coeffs
+from scipy.ndimage import convolve1d
+import perf_monitor
+
+WAVELENGTH_CO_KA1 = 1.78897 # Å
+DATA_LINE_GID = 'xrd_data' # draw_plot が描くデータ線の gid (参照ピーク線などと区別する)
+DATA_LINE_SCALE_ATTR = 'xrd_scale' # データ線に付ける縦並び倍率の属性名 (表示値 / 倍率 = 元の強度)
+
+def calculate_d_spacing(two_theta_deg, wavelength: float = WAVELENGTH_CO_KA1):
+    # ブラッグの式 nλ = 2d sin(θ) (n=1)。スカラーでも配列でも可
+    theta_rad = np.radians(np.asarray(two_theta_deg, dtype=float) / 2.0)
+    with np.errstate(divide='ignore'):
+        return wavelength / (2 * np.sin(theta_rad))
+
+def calculate_q(two_theta_deg, wavelength: float = WAVELENGTH_CO_KA1):
+    # 散乱ベクトルの大きさ Q = 4π sin(θ) / λ (Å⁻¹)
+    theta_rad = np.radians(np.asarray(two_theta_deg, dtype=float) / 2.0)
+    return 4 * np.pi * np.sin(theta_rad) / wavelength
 
 # parse_ras_file は draw_plot から切り離され、呼び出し元で処理される
 def parse_ras_file(filepath: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
@@ -22,23 +42,142 @@ def parse_ras_file(filepath: str) -> Tuple[Optional[np.ndarray], Optional[np.nda
     except Exception: return None, None
     return np.array(angles, dtype=float), np.array(intensities, dtype=float)
 
-def _find_and_draw_peaks(ax: plt.Axes, angles: np.ndarray, intensities: np.ndarray, ymax: float, settings: Dict[str, Any]):
-    if not settings.get('enabled', False):
-        return
+SMOOTHING_METHODS = ('none', 'savgol', 'gaussian')
+SMOOTHING_CACHE_SIZE = 8
+CURVATURE_NOISE_FACTOR = 5.0 # 2次微分の候補に必要な曲率の高さとプロミネンス (バックグラウンドの 2次微分ノイズの何倍か)
+MERGE_NOISE_FACTOR = 3.0 # 隣り合う候補を別ピークとみなすのに必要な、間の谷から各候補までの曲率の上昇 (その点のノイズの何倍か)
+
+_smoothing_cache: 'OrderedDict[Tuple, Tuple[Tuple[np.ndarray, ...], List[np.ndarray]]]' = OrderedDict()
+_smoothing_cache_lock = threading.Lock()
+
+def _smoothing_kernel(method: str, window: int, deriv: int = 0) -> np.ndarray:
+    # 畳み込み用のカーネル (点数は奇数)。deriv=2 で2次微分 (1点あたり) のカーネル
+    window = max(int(window) | 1, 5)
+    half = window // 2
+    if method == 'savgol':
+        return savgol_coeffs(window, polyorder=min(3, window - 2), deriv=deriv, use='conv')
+    if method == 'gaussian':
+        # 窓幅を ±3σ とみなす
+        sigma = max(window / 6.0, 0.5)
+        x = np.arange(-half, half + 1, dtype=float)
+        g = np.exp(-0.5 * (x / sigma) ** 2); g /= g.sum()
+        return g if deriv == 0 else g * (x ** 2 / sigma ** 4 - 1 / sigma ** 2)
+    raise ValueError(f"unknown smoothing method: {method}")
+
+def smooth_intensities(intensities_list: List[np.ndarray], method: str, window: int, deriv: int = 0) -> List[np.ndarray]:
+    # 全スキャンを端の値でパディングした1つの2次元配列にまとめ、1回の畳み込みで平滑化 (または微分) する。
+    # 同じ入力配列とカーネル設定の結果はキャッシュし、ピーク検出の閾値だけを変えた再描画では再計算しない
+    arrays = tuple(np.asarray(a, dtype=float) for a in intensities_list)
+    key = (method, max(int(window) | 1, 5), deriv) + tuple(id(a) for a in arrays)
+    with _smoothing_cache_lock:
+        cached = _smoothing_cache.get(key)
+        if cached is not None and all(x is y for x, y in zip(cached[0], arrays)):
+            _smoothing_cache.move_to_end(key)
+            return cached[1]
+    if not arrays: return []
+
+    kernel = _smoothing_kernel(method, window, deriv)
+    lengths = [a.size for a in arrays]
+    batch = np.empty((len(arrays), max(max(lengths), 1)))
+    for row, a in zip(batch, arrays):
+        row[:a.size] = a
+        row[a.size:] = a[-1] if a.size else 0.0
+    smoothed = convolve1d(batch, kernel, axis=1, mode='nearest')
+    result = [smoothed[i, :n] for i, n in enumerate(lengths)]
+
+    with _smoothing_cache_lock:
+        _smoothing_cache[key] = (arrays, result)
+        while len(_smoothing_cache) > SMOOTHING_CACHE_SIZE: _smoothing_cache.popitem(last=False)
+    return result
+
+def clear_smoothing_cache():
+    with _smoothing_cache_lock: _smoothing_cache.clear()
 
+def curvature_noise(raw_list: List[np.ndarray], smoothed_list: List[np.ndarray], method: str, window: int) -> List[np.ndarray]:
+    # 2次微分の各点でのノイズの標準偏差。計数データと同じく分散が強度に比例するとみなし、平滑化した強度を
+    # 2次微分カーネルの二乗で畳み込んで σ² = g Σ k₂² I とする。比例係数 g はスキャン全体の平滑化残差の MAD
+    # (大部分はバックグラウンド) から決めるので、規格化した強度でもよい。平滑化の偏りが大きいピーク頂上の残差は使わない
+    kernel = _smoothing_kernel(method, window)
+    residual_gain = np.linalg.norm(kernel - np.eye(1, kernel.size, kernel.size // 2)[0])
+    d2_kernel = _smoothing_kernel(method, window, deriv=2)
+    result = []
+    for raw, smoothed in zip(raw_list, smoothed_list):
+        residual = np.asarray(raw, dtype=float) - smoothed
+        residual = residual[np.isfinite(residual)]
+        sigma = 1.4826 * np.median(np.abs(residual - np.median(residual))) / residual_gain if residual.size else 0.0
+        level = np.nan_to_num(np.maximum(smoothed, 0))
+        background = np.median(level) if level.size else 0.0
+        gain = sigma ** 2 / background if background > 0 else 0.0
+        variance = gain * convolve1d(level, d2_kernel ** 2, mode='nearest')
+        result.append(np.sqrt(np.maximum(variance, (sigma * np.linalg.norm(d2_kernel)) ** 2)))
+    return result
+
+def _detect_peaks(angles: np.ndarray, intensities: np.ndarray, settings: Dict[str, Any],
+                  second_derivative: Optional[np.ndarray] = None, noise: Optional[np.ndarray] = None,
+                  measured: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    # intensities は検出に使う強度 (平滑化した場合はその結果)。返す強度は measured (表示している測定値) の値で、
+    # そこが非表示 (NaN) のピークは返さない
     min_height = settings.get('min_height', 0)
     min_prominence = settings.get('min_prominence', 0)
     min_width = settings.get('min_width', 0)
 
     # ピーク検出
-    peaks, properties = find_peaks(intensities, height=min_height, prominence=min_prominence, width=min_width)
+    if second_derivative is None:
+        peaks, _ = find_peaks(intensities, height=min_height, prominence=min_prominence, width=min_width)
+    else:
+        peaks = _curvature_candidates(intensities, second_derivative, settings, noise)
+
+    heights = (intensities if measured is None else measured)[peaks]
+    shown = np.isfinite(heights)
+    return angles[peaks][shown], heights[shown]
+
+def _curvature_candidates(intensities: np.ndarray, second_derivative: np.ndarray, settings: Dict[str, Any],
+                          noise: Optional[np.ndarray] = None) -> np.ndarray:
+    # 2次微分の極小 (曲率が負で最大) を候補にすると、肩になった重なりピークも拾える。
+    # 候補の曲率の高さとプロミネンスはバックグラウンドの 2次微分ノイズ (curvature_noise の中央値、なければ全体の MAD) と比べ、
+    # 強度のコントラストは候補の幅に応じた範囲 (±3幅) の最小値との差で判定する
+    min_height = settings.get('min_height', 0)
+    min_prominence = settings.get('min_prominence', 0)
+    window = max(int(settings.get('smoothing_window', 11)) | 1, 5)
+    curvature = -np.nan_to_num(np.asarray(second_derivative, dtype=float))
+    if noise is None:
+        noise = np.full(curvature.size, 1.4826 * np.median(np.abs(curvature - np.median(curvature))) if curvature.size else 0.0)
+    peaks, properties = find_peaks(curvature, height=0, prominence=0)
+    threshold = CURVATURE_NOISE_FACTOR * (np.median(noise) if noise.size else 0.0)
+    significant = (properties['peak_heights'] > threshold) & (properties['prominences'] > threshold)
+    peaks = peaks[significant]
+    if peaks.size == 0: return peaks
+    # 幅は曲率の半値 (0 基準) で測る。プロミネンス基準だと負の裾まで含んで過大になる
+    heights = properties['peak_heights'][significant]
+    widths = peak_widths(curvature, peaks, rel_height=0.5, prominence_data=(heights, properties['left_bases'][significant], properties['right_bases'][significant]))[0]
+    wide_enough = widths >= max(settings.get('min_width', 0), 1)
+    peaks, widths = peaks[wide_enough], widths[wide_enough]
+    if peaks.size == 0: return peaks
+
+    # 隣り合う候補は、1つのピーク幅以上離れていて、間の谷からどちらの候補までの曲率の上昇もその点のノイズ
+    # (谷と候補のノイズの合成) を超える場合だけ別のピークとみなす。それ以外は曲率の大きい方にまとめる。
+    # 強いピークの頂上や裾ではノイズが大きいので、そこでの揺らぎは別の候補にならない
+    groups = [[0]]
+    for i in range(1, peaks.size):
+        j = groups[-1][-1]
+        valley = peaks[j] + int(np.argmin(curvature[peaks[j]:peaks[i] + 1]))
+        separated = peaks[i] - peaks[j] >= max(widths[i], widths[j]) and all(
+            curvature[p] - curvature[valley] > MERGE_NOISE_FACTOR * np.hypot(noise[p], noise[valley]) for p in (peaks[j], peaks[i]))
+        if separated: groups.append([i])
+        else: groups[-1].append(i)
+    keep = np.array([max(g, key=lambda k: curvature[peaks[k]]) for g in groups])
+    peaks, widths = peaks[keep], widths[keep]
+
+    half_spans = np.maximum(np.ceil(3 * widths).astype(int), window // 2)
+    with np.errstate(invalid='ignore'):
+        contrast = np.array([intensities[p] - np.nanmin(intensities[max(p - h, 0):p + h + 1]) for p, h in zip(peaks, half_spans)])
+        ok = (intensities[peaks] >= min_height) & (contrast >= min_prominence)
+    return peaks[ok]
 
-    if peaks.size > 0:
-        peak_angles = angles[peaks]
-        peak_intensities = properties['peak_heights']
-        for angle, intensity in zip(peak_angles, peak_intensities):
-            # ピーク位置にテキストを追加
-            ax.text(angle, intensity, f"{angle:.1f}°", verticalalignment='bottom', horizontalalignment='center', color='purple', fontsize=8, fontweight='bold')
+def _draw_peak_labels(ax: plt.Axes, peak_angles: np.ndarray, peak_intensities: np.ndarray):
+    for angle, intensity in zip(peak_angles, peak_intensities):
+        # ピーク位置にテキストを追加
+        ax.text(angle, intensity, f"{angle:.1f}°", verticalalignment='bottom', horizontalalignment='center', color='purple', fontsize=8, fontweight='bold')
 
 
 def _draw_reference_peaks(ax: plt.Axes, peaks_to_plot: List[Dict[str, Any]], ymax: float, appearance: Dict[str, Any]):
@@ -57,22 +196,17 @@ def _draw_reference_peaks(ax: plt.Axes, peaks_to_plot: List[Dict[str, Any]], yma
             ax.text(angle + offset, label_y, name, rotation=90, verticalalignment='top', 
                     horizontalalignment='left', color=color, fontsize=peak_fontsize, fontweight='bold', transform=ax.get_xaxis_transform())
 
-def draw_plot(
-    ax: plt.Axes, plot_data_full: List[Dict[str, Any]], threshold: float, x_range: Tuple[Optional[float], Optional[float]],
-    reference_peaks: List[Dict[str, Any]], show_legend: bool, stack: bool, spacing: float, appearance: Dict[str, Any],
-    peak_detection_settings: Optional[Dict[str, Any]] = None,
-    legend_position: Optional[Tuple[float, float]] = None
-) -> Optional[str]:
-    ax.clear()
-    
-    linewidth = appearance.get('linewidth', 1.0)
-    legend_fontsize = appearance.get('legend_fontsize', 10)
+def prepare_plot_data(
+    plot_data_full: List[Dict[str, Any]], threshold: float, stack: bool, spacing: float, appearance: Dict[str, Any],
+    peak_detection_settings: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    # 描画前の数値計算 (Y軸範囲、閾値処理、スタック倍率、ピーク検出) をまとめて行う。
+    # Axes に触れないので、ワーカースレッドで実行したり、見た目だけの変更時に結果を再利用したりできる
     ytop_padding_factor = appearance.get('ytop_padding_factor', 1.5)
     threshold_handling = appearance.get('threshold_handling', 'hide') # 'hide' or 'clip'
     yscale = appearance.get('yscale', 'log')
-    font_family = appearance.get('font_family', 'sans-serif')
-
-    color_sequence = ['red', '#001aff', '#32CD32', '#FF8C00', '#9400D3', '#00CED1', '#FF1493', '#1E90FF', '#FFD700', '#ADFF2F']
+    peaks_enabled = bool(peak_detection_settings and peak_detection_settings.get('enabled', False))
+    smoothing = peak_detection_settings.get('smoothing', 'none') if peaks_enabled else 'none'
 
     all_plot_points_y = []
     current_multiplier_factor = (10**spacing) # 各プロット間での乗算係数
@@ -120,8 +254,23 @@ def draw_plot(
             ymin_val = first_plot_lowest_y_val
         else:
             ymin_val = min_all_y
-    
-    # ステップ3: データをプロットする。この際に閾値処理を適用する
+
+    # ピーク検出用の平滑化と2次微分は、全スキャンに対して一括で計算する
+    smoothed = second_derivatives = noises = None
+    use_second_derivative = peaks_enabled and peak_detection_settings.get('use_second_derivative', False)
+    # 2次微分には平滑化カーネルが必要なので、平滑化なしの場合は Savitzky-Golay を使う
+    if use_second_derivative and smoothing not in SMOOTHING_METHODS[1:]: smoothing = 'savgol'
+    if smoothing in SMOOTHING_METHODS and smoothing != 'none':
+        raw_intensities = [item['intensities'] for item in plot_data_full]
+        window = peak_detection_settings.get('smoothing_window', 11)
+        with perf_monitor.span('smoothing'):
+            smoothed = smooth_intensities(raw_intensities, smoothing, window)
+            if use_second_derivative:
+                second_derivatives = smooth_intensities(raw_intensities, smoothing, window, deriv=2)
+                noises = curvature_noise(raw_intensities, smoothed, smoothing, window)
+
+    # ステップ3: 閾値処理とスタック倍率を適用する。ピーク検出の引数はここで決め、検出は最後にまとめて行う
+    items, peak_jobs = [], []
     for idx, item in enumerate(processed_data):
         angles = item['angles']
         intensities_np = item['intensities']
@@ -137,23 +286,81 @@ def draw_plot(
 
         if np.all(np.isnan(intensities_np)): continue
 
-        current_color = color_sequence[idx % len(color_sequence)]
-        
+        item_out = {'index': idx, 'angles': angles, 'intensities': intensities_np, 'peaks': None, 'scale': 1.0}
+        detect_on = smoothed[idx] if smoothed is not None else intensities_np
+        d2 = second_derivatives[idx] if second_derivatives is not None else None
+        noise = noises[idx] if noises is not None else None
         # ピーク検出はスタック表示のスケーリング前に実施
-        if peak_detection_settings and peak_detection_settings.get('enabled', False) and not stack:
-             _find_and_draw_peaks(ax, angles, intensities_np, ymax_val, peak_detection_settings)
+        if peaks_enabled and not stack:
+            peak_jobs.append((item_out, (angles, detect_on, peak_detection_settings, d2, noise, intensities_np)))
 
         if stack:
             current_multiplier = (current_multiplier_factor ** idx)
-            intensities_np = intensities_np * current_multiplier
-            if peak_detection_settings and peak_detection_settings.get('enabled', False):
-                 # スタック表示の場合、スケーリング後の強度でピーク検出
-                 scaled_settings = peak_detection_settings.copy()
-                 scaled_settings['min_height'] = scaled_settings.get('min_height', 0) * current_multiplier
-                 _find_and_draw_peaks(ax, angles, intensities_np, ymax_val, scaled_settings)
+            item_out['intensities'] = intensities_np * current_multiplier
+            item_out['scale'] = current_multiplier
+            if peaks_enabled:
+                # スタック表示の場合、スケーリング後の強度でピーク検出
+                scaled_settings = peak_detection_settings.copy()
+                scaled_settings['min_height'] = scaled_settings.get('min_height', 0) * current_multiplier
+                peak_jobs.append((item_out, (angles, detect_on * current_multiplier, scaled_settings, d2, noise, item_out['intensities'])))
 
-        
-        ax.plot(angles, intensities_np, label=item['label'], linewidth=linewidth, color=current_color)
+        items.append(item_out)
+
+    # 計測は1回の準備につき1サンプルになるよう、全スキャン分をまとめて囲む
+    if peak_jobs:
+        with perf_monitor.span('find_peaks'):
+            for item_out, args in peak_jobs:
+                item_out['peaks'] = _detect_peaks(*args)
+
+    return {'items': items, 'ymin': ymin_val, 'ymax': ymax_val}
+
+COLOR_SEQUENCE = ['red', '#001aff', '#32CD32', '#FF8C00', '#9400D3', '#00CED1', '#FF1493', '#1E90FF', '#FFD700', '#ADFF2F']
+
+def _draw_prepared_items(ax: plt.Axes, plot_data_full: List[Dict[str, Any]], items: List[Dict[str, Any]], linewidth: float):
+    # ステップ4: データ線とピークラベルだけを描く (軸の設定はしない)
+    with perf_monitor.span('artists'):
+        for item in items:
+            idx = item['index']
+            current_color = COLOR_SEQUENCE[idx % len(COLOR_SEQUENCE)]
+            if item['peaks'] is not None:
+                _draw_peak_labels(ax, *item['peaks'])
+            line, = ax.plot(item['angles'], item['intensities'], label=plot_data_full[idx]['label'], linewidth=linewidth, color=current_color, gid=DATA_LINE_GID)
+            setattr(line, DATA_LINE_SCALE_ATTR, item.get('scale', 1.0))
+
+def _draw_legend(ax: plt.Axes, show_legend: bool, appearance: Dict[str, Any], legend_position: Optional[Tuple[float, float]]):
+    if not show_legend: return
+    legend_fontsize = appearance.get('legend_fontsize', 10)
+    frameon = appearance.get('legend_frame', True)
+    facecolor = appearance.get('legend_bgcolor', 'white')
+    if legend_position:
+        leg = ax.legend(fontsize=legend_fontsize, loc='lower left', bbox_to_anchor=legend_position, frameon=frameon, facecolor=facecolor)
+    else:
+        loc = appearance.get('legend_loc', 'best')
+        leg = ax.legend(fontsize=legend_fontsize, loc=loc, frameon=frameon, facecolor=facecolor)
+        if leg: leg.set_draggable(True)
+    if leg:
+        style = 'italic' if appearance.get('legend_italic', False) else 'normal'
+        plt.setp(leg.get_texts(), fontfamily=appearance.get('font_family', 'sans-serif'), style=style)
+
+def draw_plot(
+    ax: plt.Axes, plot_data_full: List[Dict[str, Any]], threshold: float, x_range: Tuple[Optional[float], Optional[float]],
+    reference_peaks: List[Dict[str, Any]], show_legend: bool, stack: bool, spacing: float, appearance: Dict[str, Any],
+    peak_detection_settings: Optional[Dict[str, Any]] = None,
+    legend_position: Optional[Tuple[float, float]] = None,
+    prepared: Optional[Dict[str, Any]] = None
+) -> Optional[str]:
+    ax.clear()
+    
+    yscale = appearance.get('yscale', 'log')
+    font_family = appearance.get('font_family', 'sans-serif')
+
+    # prepared はデータ系の設定が同じ prepare_plot_data の結果。渡された場合は数値計算を省略する
+    if prepared is None:
+        with perf_monitor.span('prepare'):
+            prepared = prepare_plot_data(plot_data_full, threshold, stack, spacing, appearance, peak_detection_settings)
+    ymin_val, ymax_val = prepared['ymin'], prepared['ymax']
+
+    _draw_prepared_items(ax, plot_data_full, prepared['items'], appearance.get('linewidth', 1.0))
 
     ax.set_ylim(bottom=ymin_val, top=ymax_val)
 
@@ -183,23 +390,149 @@ def draw_plot(
     else:
         ax.grid(False)
     
-    if show_legend:
-        frameon = appearance.get('legend_frame', True)
-        facecolor = appearance.get('legend_bgcolor', 'white')
-        if legend_position:
-            leg = ax.legend(fontsize=legend_fontsize, loc='lower left', bbox_to_anchor=legend_position, frameon=frameon, facecolor=facecolor)
-        else:
-            loc = appearance.get('legend_loc', 'best')
-            leg = ax.legend(fontsize=legend_fontsize, loc=loc, frameon=frameon, facecolor=facecolor)
-            if leg: leg.set_draggable(True)
-        if leg:
-            style = 'italic' if appearance.get('legend_italic', False) else 'normal'
-            plt.setp(leg.get_texts(), fontfamily=font_family, style=style)
+    _draw_legend(ax, show_legend, appearance, legend_position)
 
-    # Apply font to tick labels
-    for label in ax.get_xticklabels() + ax.get_yticklabels():
-        label.set_fontfamily(font_family)
+    # Apply font to tick labels (目盛りを生成させずに、描画時に作られるラベルへ適用する)
+    ax.tick_params(axis='both', which='both', labelfontfamily=font_family)
 
     _draw_reference_peaks(ax, reference_peaks, ymax=ax.get_ylim()[1], appearance=appearance)
 
     return None
+
+def split_dataset_panels(settings: Dict[str, Any], prepared: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    # 読み込んだデータを1つずつ別パネルにする。数値計算は全データに対して1回だけ行い (縦並びなしの
+    # prepare_plot_data の結果があればそれを使う)、各パネルは共通の Y 範囲で自分のデータ線だけを描く
+    settings = dict(settings, stack=False)
+    if prepared is None:
+        with perf_monitor.span('prepare'):
+            prepared = prepare_plot_data(settings['plot_data_full'], settings['threshold'], False, settings['spacing'], settings['appearance'], settings.get('peak_detection_settings'))
+    return [dict(settings, prepared={'items': [item], 'ymin': prepared['ymin'], 'ymax': prepared['ymax']}) for item in prepared['items']]
+
+def _draw_minor_xticks(ax: plt.Axes):
+    # 副目盛り (既定の 1° 間隔だと1パネル100本以上) とそのグリッド線を、位置ごとの Tick を作らずにそれぞれ1本の線で描く。
+    # 線の種類・寸法・色は、tick_params と grid の設定で matplotlib が作った副目盛りの Tick を1つだけ作って写す。
+    # 呼ぶ前に副目盛りの Locator を設定しておく。位置を取り出したあとは Locator を外す
+    lo, hi = sorted(ax.get_xlim())
+    tol = (hi - lo) * 1e-10
+    locs = [x for x in ax.xaxis.get_minorticklocs() if lo - tol <= x <= hi + tol]
+    ax.xaxis.set_minor_locator(NullLocator())
+    if not locs: return
+    # Axis と同じく主目盛りのあとに、グリッド線、下の目盛り線、上の目盛り線の順で、クリップせずに描く (add_line は Axes でクリップする)
+    template = ax.xaxis.get_minor_ticks(1)[0]
+    for source, xs, ys in ((template.gridline, np.repeat(locs, 3), np.tile([0.0, 1.0, np.nan], len(locs))),
+                           (template.tick1line, locs, np.zeros(len(locs))), (template.tick2line, locs, np.ones(len(locs)))):
+        if not source.get_visible(): continue
+        line = mlines.Line2D(xs, ys)
+        line.update_from(source)
+        ax.add_line(line)
+        line.set(zorder=ax.xaxis.get_zorder() + 0.01, clip_on=False, in_layout=False)
+
+def draw_plot_grid(fig, panels: List[Dict[str, Any]], nrows: int, ncols: int, sharex: bool = True, sharey: bool = False):
+    # panels は draw_plot の引数の辞書 (prepared を含んでもよい) のリスト。1つの Figure に並べて描き、
+    # 軸ラベルは Figure 全体で1回だけ、目盛りラベルは共有軸の外側のパネルだけに付ける。
+    # 各パネルはデータ線・ピークラベル・凡例・参照ピークだけを描き、スケールと Locator は共有軸なら1回だけ設定する。
+    # 副目盛りは _draw_minor_xticks で描く (パネルごとに100本以上の Tick を作ると savefig の大半がその生成と更新になるため)
+    if len(panels) > nrows * ncols: raise ValueError(f"パネル数 ({len(panels)}) が {nrows}×{ncols} のグリッドに収まりません。")
+    axes = fig.subplots(nrows, ncols, sharex=sharex, sharey=sharey, squeeze=False)
+    used = list(axes.flat[:len(panels)])
+    for ax in axes.flat[len(panels):]:
+        ax.set_visible(False)
+    if not panels: return axes
+
+    for ax, panel in zip(used, panels):
+        prepared = panel.get('prepared')
+        if prepared is None:
+            with perf_monitor.span('prepare'):
+                prepared = prepare_plot_data(panel['plot_data_full'], panel['threshold'], panel['stack'], panel['spacing'], panel['appearance'], panel.get('peak_detection_settings'))
+        _draw_prepared_items(ax, panel['plot_data_full'], prepared['items'], panel['appearance'].get('linewidth', 1.0))
+        ax.set_ylim(bottom=prepared['ymin'], top=prepared['ymax'])
+
+    for ax, panel in zip(used[:1] if sharey else used, panels):
+        ax.set_yscale(panel['appearance'].get('yscale', 'log'))
+        ax.yaxis.set_major_locator(NullLocator())
+        ax.yaxis.set_minor_locator(NullLocator())
+    for ax, panel in zip(used[:1] if sharex else used, panels):
+        ax.set_xlim(*panel['x_range'])
+        ax.xaxis.set_major_locator(MultipleLocator(panel['appearance'].get('xaxis_major_tick_spacing', 10)))
+
+    for i, (ax, panel) in enumerate(zip(used, panels)):
+        panel_appearance = panel['appearance']
+        direction = panel_appearance.get('tick_direction', 'in')
+        show_labels = not panel_appearance.get('hide_major_xtick_labels', False) and not (sharex and i + ncols < len(panels))
+        ax.tick_params(axis='x', which='major', direction=direction, labelsize=panel_appearance.get('tick_label_fontsize', 16), top=True, labeltop=False,
+                       labelbottom=show_labels, labelfontfamily=panel_appearance.get('font_family', 'sans-serif'))
+        if panel_appearance.get('show_grid', False): ax.grid(True, axis='x', which='both', ls='--', linewidth=0.5)
+        if panel_appearance.get('show_minor_xticks', False):
+            ax.tick_params(axis='x', which='minor', direction=direction, bottom=True, top=True)
+            ax.xaxis.set_minor_locator(MultipleLocator(panel_appearance.get('xminor_tick_spacing', 1.0)))
+            _draw_minor_xticks(ax)
+        else:
+            ax.xaxis.set_minor_locator(NullLocator())
+        _draw_legend(ax, panel['show_legend'], panel_appearance, panel.get('legend_position'))
+        _draw_reference_peaks(ax, panel['reference_peaks'], ymax=ax.get_ylim()[1], appearance=panel_appearance)
+
+    appearance = panels[0]['appearance']
+    font_family, fontsize = appearance.get('font_family', 'sans-serif'), appearance.get('axis_label_fontsize', 20)
+    fig.supxlabel(appearance.get('xlabel', '2θ/ω (degree)'), fontsize=fontsize, fontfamily=font_family)
+    fig.supylabel(appearance.get('ylabel', 'Log Intensity (arb. Units)'), fontsize=fontsize, fontfamily=font_family)
+    return axes
+
+# save_settings の 'variables' の既定値 (GUI の初期値と同じ)。描画に関係するものだけ
+SAVED_VARIABLE_DEFAULTS = {
+    'xmin_var': '30', 'xmax_var': '130', 'threshold_var': '1', 'show_legend_var': True, 'stack_plots_var': False,
+    'threshold_handling_var': 'clip', 'plot_spacing_var': 3.0, 'xlabel_var': '2θ/ω (degree)', 'ylabel_var': 'Log Intensity (arb. Units)',
+    'legend_loc_var': 'best', 'legend_frame_var': True, 'legend_bgcolor_var': 'white', 'legend_italic_var': False, 'yscale_var': 'log',
+    'font_family_var': 'sans-serif', 'axis_label_fontsize_var': 20.0, 'tick_label_fontsize_var': 16.0, 'legend_fontsize_var': 10.0,
+    'plot_linewidth_var': 1.0, 'tick_direction_var': 'in', 'xaxis_major_tick_spacing_var': 5.0, 'show_grid_var': False,
+    'ytop_padding_factor_var': 1.5, 'hide_major_xtick_labels_var': False, 'show_minor_xticks_var': True, 'xminor_tick_spacing_var': 1.0,
+    'peak_label_fontsize_var': 9.0, 'peak_label_offset_var': 0.4, 'peak_label_y_var': 0.9, 'match_math_font_var': False,
+    'peak_detection_enabled_var': False, 'peak_detection_height_var': 10.0, 'peak_detection_prominence_var': 10.0,
+    'peak_detection_width_var': 1.0, 'peak_detection_smoothing_var': 'none', 'peak_detection_window_var': 11,
+    'peak_detection_second_derivative_var': False,
+}
+
+def plot_settings_from_saved(saved: Dict[str, Any], parsed_data: Dict[str, Tuple[np.ndarray, np.ndarray]],
+                             filepaths: Optional[List[str]] = None) -> Dict[str, Any]:
+    # save_settings 形式の辞書を draw_plot の引数に変換する (XRDPlotter._get_current_plot_settings と同じ対応)。
+    # filepaths を省略すると設定ファイル内の順序を使う。不正な数値は ValueError
+    v = dict(SAVED_VARIABLE_DEFAULTS); v.update(saved.get('variables', {}))
+    files = saved.get('files', {})
+    labels = files.get('file_data', {})
+    if filepaths is None: filepaths = files.get('filepaths', [])
+    plot_data_full = [{'label': labels.get(fp, os.path.basename(fp)), 'angles': parsed_data[fp][0], 'intensities': parsed_data[fp][1]} for fp in filepaths if fp in parsed_data]
+
+    def optional_float(value):
+        return float(value) if str(value).strip() else None
+    threshold = optional_float(v['threshold_var']) or 0.0
+    xmin, xmax = optional_float(v['xmin_var']), optional_float(v['xmax_var'])
+    if xmin is not None and xmax is not None and xmin >= xmax: raise ValueError("xmin must be smaller than xmax")
+
+    reference_peaks = [{'name': str(p.get('name', '')).strip(), 'angle': float(str(p['angle']).strip()), 'visible': bool(p.get('visible', False)), 'color': p.get('color', '#000000'), 'linestyle': p.get('style', '--')} for p in saved.get('reference_peaks', []) if str(p.get('angle', '')).strip()]
+
+    appearance_settings = {
+        'xlabel': v['xlabel_var'], 'ylabel': v['ylabel_var'], 'axis_label_fontsize': float(v['axis_label_fontsize_var']), 'tick_label_fontsize': float(v['tick_label_fontsize_var']),
+        'legend_fontsize': float(v['legend_fontsize_var']), 'linewidth': float(v['plot_linewidth_var']), 'tick_direction': v['tick_direction_var'], 'threshold_handling': v['threshold_handling_var'],
+        'xaxis_major_tick_spacing': float(v['xaxis_major_tick_spacing_var']), 'show_grid': bool(v['show_grid_var']), 'ytop_padding_factor': float(v['ytop_padding_factor_var']),
+        'hide_major_xtick_labels': bool(v['hide_major_xtick_labels_var']), 'show_minor_xticks': bool(v['show_minor_xticks_var']), 'xminor_tick_spacing': float(v['xminor_tick_spacing_var']),
+        'peak_label_fontsize': float(v['peak_label_fontsize_var']), 'peak_label_offset': float(v['peak_label_offset_var']),
+        'peak_label_y': float(v['peak_label_y_var']), 'match_math_font': bool(v['match_math_font_var']), 'legend_loc': v['legend_loc_var'],
+        'legend_frame': bool(v['legend_frame_var']), 'legend_bgcolor': v['legend_bgcolor_var'], 'legend_italic': bool(v['legend_italic_var']),
+        'yscale': v['yscale_var'], 'font_family': v['font_family_var']
+    }
+
+    peak_detection_settings = {
+        'enabled': bool(v['peak_detection_enabled_var']),
+        'min_height': float(v['peak_detection_height_var']),
+        'min_prominence': float(v['peak_detection_prominence_var']),
+        'min_width': float(v['peak_detection_width_var']),
+        'smoothing': v['peak_detection_smoothing_var'],
+        'smoothing_window': int(v['peak_detection_window_var']),
+        'use_second_derivative': bool(v['peak_detection_second_derivative_var'])
+    }
+
+    return {
+        'plot_data_full': plot_data_full, 'threshold': threshold, 'x_range': (xmin, xmax),
+        'reference_peaks': reference_peaks, 'show_legend': bool(v['show_legend_var']),
+        'stack': bool(v['stack_plots_var']), 'spacing': float(v['plot_spacing_var']), 'appearance': appearance_settings,
+        'peak_detection_settings': peak_detection_settings
+    }
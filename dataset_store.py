@@ -0,0 +1,133 @@
+"""複数プロセスの解析ワーカーで共有するデータセットストア.
+
+GUI の parsed_data ({filepath: (angles, intensities)}) を1つの連続したバッファに詰め、
+オフセットの索引と一緒に共有メモリ (multiprocessing.shared_memory) またはメモリマップファイルに置く。
+ワーカーは handle (名前・索引・dtype だけの小さなタプル) を受け取って名前でアタッチするので、
+配列そのものは pickle されず、ゼロコピーで参照できる。
+
+    with SharedDatasetStore.create(self.parsed_data) as store:
+        results = map_datasets(analyze_one, store)
+"""
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _shm_array(shm, total: int, dtype: np.dtype) -> np.ndarray:
+    # np.frombuffer は共有メモリへのエクスポートを保持するので、この配列とそのビューが残っている間は
+    # shm.close() が BufferError になり、マッピングが外されることはない (np.ndarray(buffer=...) は保持しない)
+    return np.frombuffer(shm.buf, dtype=dtype, count=total)
+
+
+class SharedDatasetStore:
+    def __init__(self, buffer: np.ndarray, index: Dict[str, Tuple[int, int]], handle: Tuple, shm=None, owner: bool = False):
+        self._buffer, self._index, self.handle = buffer, index, handle
+        self._shm, self._owner = shm, owner
+
+    @classmethod
+    def create(cls, datasets: Dict[str, Tuple[np.ndarray, np.ndarray]], dtype=np.float64, path: Optional[str] = None) -> 'SharedDatasetStore':
+        # 各スキャンは [角度..., 強度...] の順で連続して格納する。索引は key -> (先頭オフセット, 点数)
+        dtype = np.dtype(dtype)
+        index, offset = {}, 0
+        for key, (angles, intensities) in datasets.items():
+            n = min(len(angles), len(intensities))
+            index[key] = (offset, n)
+            offset += 2 * n
+        total = max(offset, 1)
+
+        if path is None:
+            shm = shared_memory.SharedMemory(create=True, size=total * dtype.itemsize)
+            buffer = _shm_array(shm, total, dtype)
+            handle = ('shm', shm.name, index, dtype.str)
+        else:
+            shm = None
+            buffer = np.memmap(path, dtype=dtype, mode='w+', shape=(total,))
+            handle = ('mmap', path, index, dtype.str)
+
+        for key, (angles, intensities) in datasets.items():
+            start, n = index[key]
+            buffer[start:start + n] = angles[:n]
+            buffer[start + n:start + 2 * n] = intensities[:n]
+        if shm is None: buffer.flush()
+        return cls(buffer, index, handle, shm=shm, owner=True)
+
+    @classmethod
+    def attach(cls, handle: Tuple) -> 'SharedDatasetStore':
+        kind, name, index, dtype_str = handle
+        dtype = np.dtype(dtype_str)
+        total = max(sum(2 * n for _, n in index.values()), 1)
+        if kind == 'shm':
+            # 3.13 以降は track=False で、アタッチ側のリソーストラッカーに解放を任せない
+            kwargs = {'track': False} if sys.version_info >= (3, 13) else {}
+            shm = shared_memory.SharedMemory(name=name, **kwargs)
+            buffer = _shm_array(shm, total, dtype)
+        else:
+            shm = None
+            buffer = np.memmap(name, dtype=dtype, mode='r', shape=(total,))
+        buffer.flags.writeable = False
+        return cls(buffer, index, handle, shm=shm, owner=False)
+
+    def get(self, key: str) -> Tuple[np.ndarray, np.ndarray]:
+        # コピーせずにバッファのビューを返す。共有メモリの場合、ビューが残っている間は close() できない
+        start, n = self._index[key]
+        return self._buffer[start:start + n], self._buffer[start + n:start + 2 * n]
+
+    def keys(self) -> List[str]:
+        return list(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def nbytes(self) -> int:
+        return self._buffer.nbytes
+
+    def close(self):
+        # get() のビューとそこから作ったビューはすべて self._buffer を base に持つ。残っている間にマッピングを外すと
+        # その後の読み出しが不正なメモリアクセスになるので、共有メモリの場合は閉じずに BufferError を送出する
+        if self._shm is not None and self._buffer is not None and sys.getrefcount(self._buffer) > 2:
+            raise BufferError("get() が返した配列がまだ参照されているため、共有メモリを閉じられません。")
+        self._buffer = None
+        if self._shm is not None:
+            self._shm.close()
+            if self._owner: self._shm.unlink()
+            self._shm = None
+        elif self._owner and self.handle[0] == 'mmap' and os.path.exists(self.handle[1]):
+            os.remove(self.handle[1])
+        self._owner = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+# ワーカープロセス側でアタッチしたストア (プロセスごとに1回だけアタッチする)
+_worker_store: Optional[SharedDatasetStore] = None
+
+def _init_worker(handle: Tuple):
+    global _worker_store
+    _worker_store = SharedDatasetStore.attach(handle)
+
+def _run_on_dataset(func: Callable, key: str, args: Tuple):
+    angles, intensities = _worker_store.get(key)
+    return func(key, angles, intensities, *args)
+
+
+def map_datasets(func: Callable[..., Any], store: SharedDatasetStore, keys: Optional[Sequence[str]] = None,
+                 args: Tuple = (), max_workers: Optional[int] = None) -> List[Any]:
+    # func(key, angles, intensities, *args) を全 CPU で並列実行する。func はモジュールレベルの関数であること。
+    # ワーカーに送られるのはキーと args だけで、配列は共有バッファから読む
+    keys = store.keys() if keys is None else list(keys)
+    if not keys: return []
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(store.handle,)) as executor:
+        return list(executor.map(_run_on_dataset, [func] * len(keys), keys, [args] * len(keys)))
@@ -0,0 +1,122 @@
+"""ラウエ (Laue) / キージッヒ (Kiessig) フリンジからの薄膜膜厚推定.
+
+膜ピーク周辺の 2θ 窓を散乱ベクトル q = 4π sin(θ) / λ に変換すると、フリンジは q について
+周期 Δq = 2π / t で振動する (t: 膜厚)。log 強度からラウエ関数の包絡線の形と多項式の傾向を除いた振動成分に対して
+Lomb–Scargle ピリオドグラムを計算し、角周波数 = t として支配的な周期から膜厚を求める。
+オプションで、膜厚候補のグリッドに対するラウエ関数モデルを一括 (ベクトル化) で評価して精密化する。
+"""
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from scipy.signal import lombscargle
+
+import data_analyzer
+
+MIN_FRINGE_PERIODS = 2.0 # 窓内にこれ未満の周期しか入らない膜厚は信頼できない (reliable=False)
+SEARCH_MIN_PERIODS = 1.5 # 膜厚の探索範囲の下限 (窓内の周期数)。これより厚い候補だけを調べる
+
+
+def _detrend(q: np.ndarray, y: np.ndarray, order: int, q0: float) -> np.ndarray:
+    # ラウエ関数の包絡線 -log10 sin²(c Δq / 2) (ピーク位置で尖る) を差し引いてから、残りの緩やかな傾向を
+    # 多項式で近似して差し引く。多項式だけでは尖りが残り、その低周波成分がピリオドグラムで勝ってしまう。
+    # y は (n,) でも (m, n) でもよい
+    c = 2 * np.pi / q0
+    flattened = np.atleast_2d(y) + np.log10(np.maximum(np.sin(c * (q - q0) / 2) ** 2, 1e-12))
+    coeffs = np.polynomial.polynomial.polyfit(q, flattened.T, order)
+    trend = np.polynomial.polynomial.polyval(q, coeffs)
+    return (flattened - trend).reshape(np.shape(y))
+
+
+def _fringe_q_span(q: np.ndarray, q0: float) -> float:
+    # フリンジ領域の q の幅 (ピーク両側の幅の和。除外した中心付近は含めない)
+    below, above = q[q < q0], q[q >= q0]
+    return float((np.ptp(below) if below.size else 0.0) + (np.ptp(above) if above.size else 0.0))
+
+
+def _window(angles: np.ndarray, intensities: np.ndarray, center: float, half_width: float, exclude: float, wavelength: float):
+    # 窓内の有効な点を q に変換し、膜ピーク中心 q0 と、中心付近 (±exclude deg) を除いたマスクを返す
+    mask = (angles >= center - half_width) & (angles <= center + half_width) & (intensities > 0)
+    tth, counts = angles[mask], intensities[mask]
+    if tth.size < 16: return None
+    peak_region = np.abs(tth - center) <= max(exclude, 0.5)
+    tth_peak = tth[peak_region][np.argmax(counts[peak_region])] if np.any(peak_region) else center
+    q = data_analyzer.calculate_q(tth, wavelength)
+    q0 = float(data_analyzer.calculate_q(tth_peak, wavelength))
+    fringe_mask = np.abs(tth - tth_peak) > exclude
+    return q, np.log10(counts), q0, fringe_mask
+
+
+def laue_log_intensity(q: np.ndarray, q0: float, thickness: np.ndarray) -> np.ndarray:
+    # ラウエ関数 sin²(N c Δq / 2) / sin²(c Δq / 2) の log10。thickness を (m,) で渡すと (m, n) を返す
+    c = 2 * np.pi / q0 # 面間隔
+    t = np.asarray(thickness, dtype=float)[..., None]
+    dq = q - q0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        numerator = np.sin(t * dq / 2) ** 2
+        denominator = np.sin(c * dq / 2) ** 2
+        ratio = np.where(np.abs(dq) < 1e-12, (t / c) ** 2, numerator / denominator)
+    return np.log10(np.maximum(ratio, 1e-12))
+
+
+def estimate_film_thickness(
+    angles: np.ndarray, intensities: np.ndarray, center: float, half_width: float = 2.0, exclude: float = 0.15,
+    thickness_range: Tuple[float, float] = (20.0, 2000.0), refine: bool = False, detrend_order: int = 3,
+    wavelength: float = data_analyzer.WAVELENGTH_CO_KA1, n_frequencies: int = 4000
+) -> Optional[Dict[str, Any]]:
+    # 膜厚は Å 単位。窓内のデータが不足している場合、または探索範囲に窓内で SEARCH_MIN_PERIODS 周期以上
+    # 入る膜厚がない場合は None。n_periods (推定膜厚で窓内に入る周期数) が MIN_FRINGE_PERIODS 未満なら reliable=False
+    window = _window(angles, intensities, center, half_width, exclude, wavelength)
+    if window is None: return None
+    q, log_i, q0, fringe_mask = window
+    if np.count_nonzero(fringe_mask) < 16: return None
+
+    q_f = q[fringe_mask]
+    span = _fringe_q_span(q_f, q0)
+    lower = max(thickness_range[0], SEARCH_MIN_PERIODS * 2 * np.pi / span) if span > 0 else np.inf
+    if lower >= thickness_range[1]: return None
+    oscillation = _detrend(q_f, log_i[fringe_mask], detrend_order, q0)
+    oscillation = oscillation - oscillation.mean()
+
+    thickness_grid = np.linspace(lower, thickness_range[1], n_frequencies)
+    power = lombscargle(q_f, oscillation, thickness_grid, normalize=True)
+    best = int(np.argmax(power))
+    thickness = float(thickness_grid[best])
+    n_periods = thickness * span / (2 * np.pi)
+
+    result = {
+        'thickness': thickness, 'thickness_refined': None, 'fringe_period_q': 2 * np.pi / thickness,
+        'n_periods': n_periods, 'reliable': n_periods >= MIN_FRINGE_PERIODS,
+        'power': float(power[best]), 'q0': q0, 'two_theta_peak': float(np.degrees(2 * np.arcsin(q0 * wavelength / (4 * np.pi))))
+    }
+    if refine:
+        result['thickness_refined'] = refine_film_thickness(q_f, oscillation, q0, thickness, detrend_order)
+    return result
+
+
+def refine_film_thickness(q: np.ndarray, oscillation: np.ndarray, q0: float, thickness: float, detrend_order: int = 3,
+                          span: float = 0.15, n_candidates: int = 301) -> float:
+    # 推定値 ±span の膜厚候補すべてについてモデルを一度に計算し、振動成分との相関が最大のものを選ぶ
+    candidates = np.linspace(thickness * (1 - span), thickness * (1 + span), n_candidates)
+    models = _detrend(q, laue_log_intensity(q, q0, candidates), detrend_order, q0)
+    models = models - models.mean(axis=1, keepdims=True)
+    data = oscillation - oscillation.mean()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        score = (models @ data) / (np.linalg.norm(models, axis=1) * np.linalg.norm(data))
+    return float(candidates[int(np.nanargmax(score))])
+
+
+def _estimate_for_dataset(key: str, angles: np.ndarray, intensities: np.ndarray, kwargs: Dict[str, Any]):
+    return estimate_film_thickness(angles, intensities, **kwargs)
+
+
+def estimate_thickness_series(datasets: Dict[str, Tuple[np.ndarray, np.ndarray]], center: float,
+                              max_workers: Optional[int] = None, **kwargs) -> Dict[str, Optional[Dict[str, Any]]]:
+    # サンプル系列全体に同じ窓と設定で適用する。max_workers を指定すると共有メモリ経由で並列実行する
+    kwargs['center'] = center
+    if max_workers is None or max_workers <= 1 or len(datasets) < 2:
+        return {key: estimate_film_thickness(a, i, **kwargs) for key, (a, i) in datasets.items()}
+
+    from dataset_store import SharedDatasetStore, map_datasets
+    with SharedDatasetStore.create(datasets) as store:
+        keys = store.keys()
+        return dict(zip(keys, map_datasets(_estimate_for_dataset, store, keys, args=(kwargs,), max_workers=max_workers)))
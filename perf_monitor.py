@@ -0,0 +1,156 @@
+"""再描画パイプラインの計測 (オプトイン).
+
+    with perf_monitor.span('find_peaks'):
+        ...
+
+無効時の span() は共有の何もしないコンテキストを返すだけなので、ほぼゼロコストで
+呼び出し側に残しておける。環境変数 XRD_PERF=1 で起動時から有効になる。
+"""
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import numpy as np
+
+WINDOW_SIZE = 200 # ステージごとに保持する直近の計測数
+HISTOGRAM_EDGES_MS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float('inf')]
+
+_enabled = os.environ.get('XRD_PERF', '') not in ('', '0')
+_samples: Dict[str, deque] = {}
+_samples_lock = threading.Lock() # record() は描画準備のワーカースレッドからも呼ばれる
+_last_redraw: Dict[str, float] = {}
+_profile_remaining = 0
+_profile_path: Optional[str] = None
+_profiler: Optional[cProfile.Profile] = None
+
+
+class _NullSpan:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        record(self.name, elapsed)
+        return False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+def set_enabled(flag: bool):
+    global _enabled
+    _enabled = bool(flag)
+
+def span(name: str):
+    if not _enabled: return _NULL_SPAN
+    return _Span(name)
+
+def record(name: str, elapsed: float):
+    # 1回の呼び出しを1サンプルとして記録する。ループ内で呼ぶと統計が1要素あたりの値になるので、
+    # span はループ全体を囲むこと
+    with _samples_lock:
+        buf = _samples.get(name)
+        if buf is None: buf = _samples[name] = deque(maxlen=WINDOW_SIZE)
+        buf.append(elapsed)
+        _last_redraw[name] = _last_redraw.get(name, 0.0) + elapsed
+
+def reset():
+    with _samples_lock:
+        _samples.clear(); _last_redraw.clear()
+
+def _snapshot() -> Dict[str, np.ndarray]:
+    with _samples_lock:
+        return {name: np.array(buf, dtype=float) for name, buf in _samples.items()}
+
+
+def summary() -> Dict[str, Dict[str, float]]:
+    # 各ステージの直近 WINDOW_SIZE 回の統計 (ミリ秒)
+    result = {}
+    for name, samples in _snapshot().items():
+        ms = samples * 1e3
+        result[name] = {
+            'count': int(ms.size), 'mean': float(ms.mean()), 'p50': float(np.percentile(ms, 50)),
+            'p90': float(np.percentile(ms, 90)), 'max': float(ms.max())
+        }
+    return result
+
+def histogram(name: str) -> List[int]:
+    with _samples_lock:
+        samples = np.array(_samples.get(name, ()), dtype=float)
+    if samples.size == 0: return [0] * (len(HISTOGRAM_EDGES_MS) - 1)
+    counts, _ = np.histogram(samples * 1e3, bins=HISTOGRAM_EDGES_MS)
+    return counts.tolist()
+
+def format_summary() -> str:
+    stats = summary()
+    if not stats: return "計測データがありません。"
+    edges = HISTOGRAM_EDGES_MS
+    bucket_labels = [f"<{int(e)}" for e in edges[1:-1]] + [f">={int(edges[-2])}"]
+    lines = [f"{'stage':<16}{'n':>5}{'mean':>9}{'p50':>9}{'p90':>9}{'max':>9}  (ms)"]
+    for name, s in stats.items():
+        lines.append(f"{name:<16}{s['count']:>5}{s['mean']:>9.2f}{s['p50']:>9.2f}{s['p90']:>9.2f}{s['max']:>9.2f}")
+    lines.append("")
+    lines.append(f"{'histogram':<16}" + "".join(f"{b:>7}" for b in bucket_labels))
+    for name in stats:
+        lines.append(f"{name:<16}" + "".join(f"{c:>7}" for c in histogram(name)))
+    return "\n".join(lines)
+
+
+def profile_next(n: int, output_path: str):
+    # 次の n 回の再描画を cProfile で記録し、output_path に書き出す
+    global _profile_remaining, _profile_path
+    _profile_remaining, _profile_path = max(int(n), 0), output_path
+
+
+class _Redraw:
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        global _profiler
+        with _samples_lock: _last_redraw.clear()
+        if _profile_remaining > 0:
+            if _profiler is None: _profiler = cProfile.Profile()
+            _profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        global _profiler, _profile_remaining
+        if _profiler is not None and _profile_remaining > 0:
+            _profiler.disable()
+            _profile_remaining -= 1
+            if _profile_remaining == 0:
+                _profiler.dump_stats(_profile_path)
+                pstats.Stats(_profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(15)
+                _profiler = None
+        if _enabled:
+            with _samples_lock: totals = list(_last_redraw.items())
+            stages = ", ".join(f"{k}={v * 1e3:.1f}ms" for k, v in totals)
+            print(f"[perf] {self.name}: {stages}", file=sys.stderr)
+        return False
+
+def redraw(name: str = 'redraw'):
+    # 再描画1回分を囲む。プロファイル予約時と計測有効時以外は何もしない
+    if not _enabled and _profile_remaining == 0: return _NULL_SPAN
+    return _Redraw(name)
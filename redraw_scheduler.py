@@ -0,0 +1,167 @@
+"""再描画のスケジューリング.
+
+_get_current_plot_settings の結果を「データ」「レイアウト」「スタイル」に分類して前回と比較し、
+必要最小限の再描画だけを行うための判定と、prepare_plot_data 結果のキャッシュ、
+重いデータ再計算のワーカースレッド実行、直近の描画コストに応じたデバウンス時間を扱う。
+Tk には依存しない。
+"""
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+import data_analyzer
+
+# 変更の種類。数値が大きいほど高コストな再描画が必要
+LAYOUT, STYLE, DATA = 1, 2, 3
+
+# prepare_plot_data の結果に影響する外観設定
+DATA_APPEARANCE_KEYS = ('threshold_handling', 'yscale', 'ytop_padding_factor')
+
+WORKER_POINT_THRESHOLD = 1_000_000 # 総点数がこれを超える場合はワーカーで再計算する
+MIN_DEBOUNCE_MS, MAX_DEBOUNCE_MS, DEFAULT_DEBOUNCE_MS = 30, 400, 250
+
+
+def _same(a: Any, b: Any) -> bool:
+    # 配列は同一オブジェクトかどうかで比較する (parsed_data の配列は読み込み後に変更されない)
+    if isinstance(a, tuple) and isinstance(b, tuple):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    if hasattr(a, 'shape') or hasattr(b, 'shape'):
+        return a is b
+    return a == b
+
+
+def data_key(settings: Dict[str, Any]) -> Tuple:
+    peak_settings = settings.get('peak_detection_settings') or {}
+    appearance = settings['appearance']
+    return (
+        tuple((item['angles'], item['intensities']) for item in settings['plot_data_full']),
+        settings['threshold'], settings['stack'],
+        settings['spacing'] if settings['stack'] else None, # 縦並びでない場合は間隔は無関係
+        tuple(appearance.get(k) for k in DATA_APPEARANCE_KEYS),
+        tuple(sorted(peak_settings.items())) if peak_settings.get('enabled', False) else None,
+    )
+
+
+def style_key(settings: Dict[str, Any]) -> Tuple:
+    appearance = settings['appearance']
+    return (
+        tuple(item['label'] for item in settings['plot_data_full']),
+        tuple(tuple(sorted(p.items())) for p in settings['reference_peaks']),
+        settings['show_legend'], settings.get('legend_position'),
+        tuple(sorted((k, v) for k, v in appearance.items() if k not in DATA_APPEARANCE_KEYS)),
+    )
+
+
+def fingerprint(settings: Dict[str, Any]) -> Dict[str, Tuple]:
+    return {'data': data_key(settings), 'layout': tuple(settings['x_range']), 'style': style_key(settings)}
+
+
+def classify_change(old: Optional[Dict[str, Tuple]], new: Dict[str, Tuple]) -> Optional[int]:
+    # 変更なしなら None、そうでなければ必要な再描画の種類を返す
+    if old is None or not _same(old['data'], new['data']): return DATA
+    if not _same(old['style'], new['style']): return STYLE
+    if old['layout'] != new['layout']:
+        # 範囲が空欄 (自動) になる場合は set_xlim だけでは元に戻らないので全体を描き直す
+        if None in old['layout'] or None in new['layout']: return STYLE
+        return LAYOUT
+    return None
+
+
+class RedrawScheduler:
+    def __init__(self):
+        self.committed: Optional[Dict[str, Tuple]] = None # 画面に表示中の設定
+        self._prepared_key: Optional[Tuple] = None
+        self._prepared: Optional[Dict[str, Any]] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Optional[Tuple[Tuple, Future]] = None
+        self._cost_ms: Dict[int, float] = {} # 変更の種類ごとの描画コストの移動平均 (ms)
+        self._last_change: Optional[int] = None
+        self._prepare_seconds = 0.0 # 次の DATA 描画のコストに含める、ワーカーでの prepare_plot_data の時間
+
+    def classify(self, settings: Dict[str, Any]) -> Tuple[Optional[int], Dict[str, Tuple]]:
+        fp = fingerprint(settings)
+        return classify_change(self.committed, fp), fp
+
+    def commit(self, fp: Optional[Dict[str, Tuple]]):
+        self.committed = fp
+
+    def cached_prepared(self, fp: Dict[str, Tuple]) -> Optional[Dict[str, Any]]:
+        if self._prepared_key is not None and _same(self._prepared_key, fp['data']): return self._prepared
+        return None
+
+    def is_heavy(self, settings: Dict[str, Any]) -> bool:
+        return sum(item['intensities'].size for item in settings['plot_data_full']) > WORKER_POINT_THRESHOLD
+
+    def prepare(self, settings: Dict[str, Any], fp: Dict[str, Tuple]) -> Dict[str, Any]:
+        self._prepared = data_analyzer.prepare_plot_data(
+            settings['plot_data_full'], settings['threshold'], settings['stack'], settings['spacing'],
+            settings['appearance'], settings['peak_detection_settings'])
+        self._prepared_key = fp['data']
+        return self._prepared
+
+    def submit(self, settings: Dict[str, Any], fp: Dict[str, Tuple]):
+        # 同じデータの計算が実行中ならそのまま待つ。古い計算は未開始なら取り消し、実行中なら結果を捨てる
+        if self._pending is not None:
+            key, future = self._pending
+            if _same(key, fp['data']): return
+            future.cancel()
+        if self._executor is None: self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='xrd-prepare')
+        future = self._executor.submit(
+            _timed_prepare, settings['plot_data_full'], settings['threshold'], settings['stack'],
+            settings['spacing'], settings['appearance'], settings['peak_detection_settings'])
+        self._pending = (fp['data'], future)
+
+    def is_pending(self) -> bool:
+        return self._pending is not None
+
+    def poll(self) -> bool:
+        # 実行中の計算が終わっていれば結果をキャッシュして True を返す
+        if self._pending is None: return False
+        key, future = self._pending
+        if not future.done(): return False
+        self._pending = None
+        (self._prepared, seconds), self._prepared_key = future.result(), key
+        self._prepare_seconds += seconds
+        return True
+
+    def record_cost(self, change: int, seconds: float):
+        # 実際に描画した更新だけを記録する。DATA にはワーカー分も含めた再計算の時間を加える
+        if change == DATA: seconds += self._prepare_seconds; self._prepare_seconds = 0.0
+        ms = seconds * 1e3
+        previous = self._cost_ms.get(change)
+        self._cost_ms[change] = ms if previous is None else 0.7 * previous + 0.3 * ms
+        self._last_change = change
+
+    def debounce_ms(self, change: Optional[int] = None) -> int:
+        # 描画が軽いときは素早く、重いときは入力が落ち着くまで長めに待つ。
+        # change を省略すると、直前に描画した種類 (= 今操作している種類) のコストを使う
+        cost = self._cost_ms.get(change if change is not None else self._last_change)
+        if cost is None: return DEFAULT_DEBOUNCE_MS
+        return int(min(max(cost * 1.5, MIN_DEBOUNCE_MS), MAX_DEBOUNCE_MS))
+
+    def reset(self):
+        self.committed = None
+        self._prepared_key = self._prepared = None
+        self._prepare_seconds = 0.0
+        if self._pending is not None: self._pending[1].cancel(); self._pending = None
+
+    def timer(self, change: int):
+        return _CostTimer(self, change)
+
+
+def _timed_prepare(*args) -> Tuple[Dict[str, Any], float]:
+    start = time.perf_counter()
+    return data_analyzer.prepare_plot_data(*args), time.perf_counter() - start
+
+
+class _CostTimer:
+    def __init__(self, scheduler: RedrawScheduler, change: int):
+        self.scheduler, self.change = scheduler, change
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None: self.scheduler.record_cost(self.change, time.perf_counter() - self.start)
+        return False
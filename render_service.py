@@ -0,0 +1,197 @@
+"""描画・ピーク解析のローカルサービス.
+
+常駐プロセスとして localhost (または Unix ソケット) で HTTP リクエストを受け付け、
+save_settings 形式の設定 JSON とファイル参照から、GUI と同じ draw_plot の図 (PNG/SVG/PDF) や
+ピーク表を返す。描画はワーカープロセスのプールで行い、各ワーカーは matplotlib/scipy を
+読み込んだまま、パース済みスキャンのキャッシュを保持する。
+
+    python render_service.py --port 8765 --workers 4
+    python render_service.py --socket /tmp/xrd.sock
+
+    POST /render  {"settings": {...}, "files": [...], "format": "png", "width": 6, "height": 6, "dpi": 300}
+    POST /peaks   {"settings": {...}, "files": [...]}
+    GET  /health
+"""
+import argparse
+import io
+import json
+import os
+import socketserver
+import stat
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml', 'pdf': 'application/pdf'}
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+SCAN_CACHE_SIZE = 256 # ワーカーごとに保持するパース済みスキャン数
+
+
+# ---- ワーカープロセス側 ----
+
+_scan_cache: 'OrderedDict[str, Tuple[Tuple[int, int], Any]]' = OrderedDict()
+
+def _init_worker():
+    # 起動時に重いモジュールを読み込んでおく (リクエストごとの起動コストをなくす)
+    import matplotlib
+    matplotlib.use('Agg')
+    import data_analyzer  # noqa: F401
+    import matplotlib.pyplot  # noqa: F401
+
+def _load_scans(filepaths) -> Dict[str, Any]:
+    import data_analyzer
+    parsed = {}
+    for fp in filepaths:
+        st = os.stat(fp) # 存在しない場合は FileNotFoundError をそのまま返す
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = _scan_cache.get(fp)
+        if cached is None or cached[0] != stamp:
+            angles, intensities = data_analyzer.parse_ras_file(fp)
+            if angles is None: raise ValueError(f"ファイルを読み込めません: {fp}")
+            cached = _scan_cache[fp] = (stamp, (angles, intensities))
+            while len(_scan_cache) > SCAN_CACHE_SIZE: _scan_cache.popitem(last=False)
+        _scan_cache.move_to_end(fp)
+        parsed[fp] = cached[1]
+    return parsed
+
+def _request_settings(request: Dict[str, Any]):
+    import data_analyzer
+    saved = request.get('settings', {})
+    filepaths = request.get('files') or saved.get('files', {}).get('filepaths', [])
+    parsed = _load_scans(filepaths)
+    return data_analyzer.plot_settings_from_saved(saved, parsed, filepaths)
+
+def render_figure(request: Dict[str, Any]) -> bytes:
+    import matplotlib.pyplot as plt
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import data_analyzer
+
+    fmt = request.get('format', 'png')
+    width, height, dpi = float(request.get('width', 6)), float(request.get('height', 6)), float(request.get('dpi', 300))
+    settings = _request_settings(request)
+
+    fig = Figure(figsize=(width, height), dpi=dpi)
+    FigureCanvasAgg(fig)
+    rc_params = {'mathtext.default': 'regular'} if settings['appearance'].get('match_math_font', False) else {}
+    with plt.rc_context(rc_params):
+        data_analyzer.draw_plot(ax=fig.add_subplot(111), **settings)
+        fig.subplots_adjust(left=0.1, right=0.95, top=0.95, bottom=0.1)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, dpi=dpi, bbox_inches='tight', transparent=bool(request.get('transparent', True)))
+    return buffer.getvalue()
+
+def peak_table(request: Dict[str, Any]) -> Dict[str, Any]:
+    import data_analyzer
+    settings = _request_settings(request)
+    peak_settings = dict(settings['peak_detection_settings'], enabled=True)
+    # ピーク表は縦並びの倍率を掛けない元の強度で作る
+    prepared = data_analyzer.prepare_plot_data(settings['plot_data_full'], settings['threshold'], False, settings['spacing'], settings['appearance'], peak_settings)
+    rows = []
+    for item in prepared['items']:
+        label = settings['plot_data_full'][item['index']]['label']
+        peak_angles, peak_heights = item['peaks']
+        d_values = data_analyzer.calculate_d_spacing(peak_angles)
+        rows.extend({'label': label, 'two_theta': float(a), 'intensity': float(h), 'd_spacing': float(d)} for a, h, d in zip(peak_angles, peak_heights, d_values))
+    return {'peaks': rows}
+
+
+# ---- HTTP サーバー側 ----
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'XRDRenderService/1.0'
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+
+    def do_GET(self):
+        if self.path == '/health': self._send_json(200, {'status': 'ok'})
+        else: self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path not in ('/render', '/peaks'): self._send_json(404, {'error': 'not found'}); return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > MAX_REQUEST_BYTES: self._send_json(413, {'error': 'request too large'}); return
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/render':
+                fmt = request.get('format', 'png')
+                if fmt not in CONTENT_TYPES: self._send_json(400, {'error': f"unsupported format: {fmt}"}); return
+                body = self.server.executor.submit(render_figure, request).result()
+                self._send(200, body, CONTENT_TYPES[fmt])
+            else:
+                self._send_json(200, self.server.executor.submit(peak_table, request).result())
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            self._send_json(400, {'error': f"{type(e).__name__}: {e}"})
+        except Exception as e:
+            self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+
+    def address_string(self):
+        # Unix ソケットではクライアントアドレスが空文字列になる
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name, self.server_port = 'localhost', 0
+
+
+def _is_socket(path: str) -> bool:
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def create_server(host: str = '127.0.0.1', port: int = 8765, socket_path: Optional[str] = None, workers: Optional[int] = None):
+    if socket_path:
+        # 前回の残りのソケットだけを消す。通常のファイルなどは誤指定とみなして消さずに止める
+        if _is_socket(socket_path): os.remove(socket_path)
+        elif os.path.lexists(socket_path): raise FileExistsError(f"{socket_path} はソケットではないため使用できません")
+        server = _ThreadingUnixHTTPServer(socket_path, RenderRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RenderRequestHandler)
+    server.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    # 最初のリクエストを待たずにワーカーを起動しておく
+    for _ in range(workers or os.cpu_count() or 1): server.executor.submit(int)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="XRD 描画・ピーク解析のローカルサービス")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', help="TCP の代わりに使う Unix ソケットのパス")
+    parser.add_argument('--workers', type=int, default=None, help="描画ワーカープロセス数 (既定: CPU 数)")
+    args = parser.parse_args(argv)
+
+    try:
+        server = create_server(args.host, args.port, args.socket, args.workers)
+    except FileExistsError as e:
+        parser.error(str(e))
+    where = args.socket or f"http://{args.host}:{args.port}"
+    print(f"XRD render service listening on {where}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown(cancel_futures=True)
+        if args.socket and _is_socket(args.socket): os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
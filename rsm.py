@@ -0,0 +1,129 @@
+"""逆格子マップ (RSM) の読み込みと Q 空間へのグリッド化.
+
+ω 方向にオフセットをずらした複数の 2θ/ω スキャン (RAS のセグメント) を1つの連続配列に読み込み、
+(ω, 2θ) をベクトル化した三角関数で (Qx, Qz) に変換したうえで、点ごとの補間ではなく
+np.bincount によるビン平均で規則的な Q 空間メッシュに載せる。
+"""
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
+import numpy as np
+
+import data_analyzer
+
+
+def parse_ras_segments(filepath: str) -> List[Tuple[Dict[str, str], np.ndarray, np.ndarray]]:
+    # 1ファイルに含まれる全セグメントを (ヘッダー, 角度, 強度) のリストで返す
+    segments = []
+    header, angles, intensities = {}, [], []
+    in_header = in_data = False
+    with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.strip()
+            if line == '*RAS_HEADER_START': in_header, header = True, {}; continue
+            if line == '*RAS_HEADER_END': in_header = False; continue
+            if line == '*RAS_INT_START': in_data, angles, intensities = True, [], []; continue
+            if line == '*RAS_INT_END':
+                in_data = False
+                segments.append((header, np.array(angles, dtype=float), np.array(intensities, dtype=float)))
+                continue
+            if in_header and line.startswith('*'):
+                key, _, value = line.partition(' ')
+                header[key] = value.strip().strip('"')
+            elif in_data:
+                parts = line.split()
+                try:
+                    if len(parts) >= 2: angles.append(float(parts[0])); intensities.append(float(parts[1]))
+                except ValueError: continue
+    return segments
+
+
+def segment_omega_offset(header: Dict[str, str]) -> Optional[float]:
+    # ω 軸の位置 (*MEAS_COND_AXIS_POSITION-n, 軸名が Omega のもの) とスキャン開始 2θ から ω - 2θ/2 を求める
+    for key, name in header.items():
+        if not key.startswith('*MEAS_COND_AXIS_NAME'): continue
+        if name.replace(' ', '').lower() not in ('omega', 'ω'): continue
+        suffix = key.rsplit('-', 1)[-1]
+        try:
+            omega = float(header[f'*MEAS_COND_AXIS_POSITION-{suffix}'])
+            scan_start = float(header['*MEAS_SCAN_START'])
+        except (KeyError, ValueError):
+            continue
+        return omega - scan_start / 2
+    return None
+
+
+def load_rsm(filepaths: Sequence[str], offsets: Optional[Sequence[float]] = None) -> Dict[str, Any]:
+    # 全セグメントを ω, 2θ, 強度の連続した1次元配列にまとめる。
+    # offsets を渡した場合はヘッダーの代わりにセグメント順の ω オフセットとして使う
+    segments = []
+    for fp in filepaths:
+        segments.extend(parse_ras_segments(fp))
+    if not segments: raise ValueError("RAS データのセグメントが見つかりません。")
+    if offsets is not None and len(offsets) != len(segments):
+        raise ValueError(f"ωオフセットの数 ({len(offsets)}) がセグメント数 ({len(segments)}) と一致しません。")
+
+    total = sum(seg[1].size for seg in segments)
+    omega, two_theta, intensity = np.empty(total), np.empty(total), np.empty(total)
+    start = 0
+    for i, (header, angles, counts) in enumerate(segments):
+        offset = offsets[i] if offsets is not None else segment_omega_offset(header)
+        if offset is None: raise ValueError(f"セグメント {i + 1} の ω オフセットをヘッダーから取得できません。")
+        stop = start + angles.size
+        two_theta[start:stop] = angles
+        omega[start:stop] = angles / 2 + offset
+        intensity[start:stop] = counts
+        start = stop
+    return {'omega': omega, 'two_theta': two_theta, 'intensity': intensity, 'segments': len(segments),
+            'label': os.path.basename(filepaths[0]) if len(filepaths) == 1 else f"{len(filepaths)} files"}
+
+
+def to_q_space(omega: np.ndarray, two_theta: np.ndarray, wavelength: float = data_analyzer.WAVELENGTH_CO_KA1) -> Tuple[np.ndarray, np.ndarray]:
+    # Qx = K (cos ω - cos(2θ - ω)), Qz = K (sin ω + sin(2θ - ω)), K = 2π / λ (Å⁻¹)
+    k = 2 * np.pi / wavelength
+    w = np.radians(omega); exit_angle = np.radians(two_theta) - w
+    return k * (np.cos(w) - np.cos(exit_angle)), k * (np.sin(w) + np.sin(exit_angle))
+
+
+def grid_rsm(qx: np.ndarray, qz: np.ndarray, intensity: np.ndarray, bins: Tuple[int, int] = (400, 400),
+             ranges: Optional[Tuple[Tuple[float, float], Tuple[float, float]]] = None):
+    # 各点を所属するビンの通し番号に変換し、強度の和と点数を np.bincount で一度に集計して平均する。
+    # 点のないビンは NaN。戻り値の grid は (nz, nx)
+    nx, nz = bins
+    finite = np.isfinite(qx) & np.isfinite(qz) & np.isfinite(intensity)
+    qx, qz, intensity = qx[finite], qz[finite], intensity[finite]
+    if ranges is None: ranges = ((qx.min(), qx.max()), (qz.min(), qz.max()))
+    (x0, x1), (z0, z1) = ranges
+    ix = np.floor((qx - x0) / (x1 - x0) * nx).astype(np.int64)
+    iz = np.floor((qz - z0) / (z1 - z0) * nz).astype(np.int64)
+    # 上端ちょうどの点は最後のビンに含める
+    ix[qx == x1] = nx - 1; iz[qz == z1] = nz - 1
+    inside = (ix >= 0) & (ix < nx) & (iz >= 0) & (iz < nz)
+    flat = iz[inside] * nx + ix[inside]
+    sums = np.bincount(flat, weights=intensity[inside], minlength=nx * nz)
+    counts = np.bincount(flat, minlength=nx * nz)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        grid = (sums / counts).reshape(nz, nx)
+    return grid, np.linspace(x0, x1, nx + 1), np.linspace(z0, z1, nz + 1)
+
+
+def draw_rsm(ax: plt.Axes, grid: np.ndarray, qx_edges: np.ndarray, qz_edges: np.ndarray, style: str = 'image',
+             levels: int = 20, cmap: str = 'jet'):
+    # 強度を対数スケールで表示する。style は 'image' または 'contour'
+    ax.clear()
+    positive = grid[np.isfinite(grid) & (grid > 0)]
+    if positive.size == 0:
+        ax.text(0.5, 0.5, "表示できるデータがありません", ha='center', va='center', transform=ax.transAxes)
+        return None
+    norm = LogNorm(vmin=max(positive.min(), 1e-3), vmax=positive.max())
+    masked = np.ma.masked_invalid(np.where(grid > 0, grid, np.nan))
+    if style == 'contour':
+        qx_centers = (qx_edges[:-1] + qx_edges[1:]) / 2; qz_centers = (qz_edges[:-1] + qz_edges[1:]) / 2
+        mappable = ax.contourf(qx_centers, qz_centers, masked, levels=np.geomspace(norm.vmin, norm.vmax, levels), norm=norm, cmap=cmap)
+    else:
+        mappable = ax.imshow(masked, origin='lower', aspect='auto', interpolation='nearest', norm=norm, cmap=cmap,
+                             extent=(qx_edges[0], qx_edges[-1], qz_edges[0], qz_edges[-1]))
+    ax.set_xlabel('Qx (Å$^{-1}$)'); ax.set_ylabel('Qz (Å$^{-1}$)')
+    return mappable
@@ -0,0 +1,120 @@
+"""ファイル一覧用のスパークライン (log 強度の小さなサムネイル) とその永続キャッシュ.
+
+スパークラインは min/max 間引きした配列から numpy だけで直接ラスタライズし、Tk の PhotoImage が
+そのまま読める PPM (P6) バイト列として保存する。matplotlib は使わないので、ワーカースレッドで
+安全に生成できる。キャッシュのキーはファイルパス・更新時刻・サイズ。
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+
+import data_analyzer
+
+THUMBNAIL_SIZE = (120, 28) # (幅, 高さ) ピクセル
+LINE_COLOR = (0, 26, 255)
+BACKGROUND_COLOR = (255, 255, 255)
+
+
+def default_cache_dir() -> str:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'xrd_analysis', 'thumbnails')
+
+
+def decimate_minmax(values: np.ndarray, n_bins: int) -> Tuple[np.ndarray, np.ndarray]:
+    # 各ビン (= 画素列) の最小値と最大値。ピークを取りこぼさずに点数を n_bins まで減らす
+    values = np.asarray(values, dtype=float)
+    if values.size == 0: return np.full(n_bins, np.nan), np.full(n_bins, np.nan)
+    edges = np.linspace(0, values.size, n_bins + 1).astype(np.int64)
+    edges[1:] = np.maximum(edges[1:], edges[:-1] + 1) # 点数がビン数より少ない場合も空ビンを作らない
+    edges = np.minimum(edges, values.size)
+    starts = np.minimum(edges[:-1], values.size - 1)
+    with np.errstate(invalid='ignore'):
+        return np.fmin.reduceat(values, starts), np.fmax.reduceat(values, starts)
+
+
+def render_sparkline(intensities: np.ndarray, size: Tuple[int, int] = THUMBNAIL_SIZE) -> bytes:
+    # log10 強度の min/max 包絡を画素列ごとの縦線として塗り、PPM バイト列を返す
+    width, height = size
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_i = np.log10(np.where(np.asarray(intensities, dtype=float) > 0, intensities, np.nan))
+    lo, hi = decimate_minmax(log_i, width)
+    image = np.empty((height, width, 3), dtype=np.uint8); image[:] = BACKGROUND_COLOR
+    finite = np.isfinite(lo) & np.isfinite(hi)
+    if np.any(finite):
+        vmin, vmax = np.nanmin(lo[finite]), np.nanmax(hi[finite])
+        scale = (height - 1) / (vmax - vmin) if vmax > vmin else 0.0
+        # 行番号は上が 0 なので反転する
+        top = np.where(finite, (height - 1) - np.round((hi - vmin) * scale), height).astype(np.int64)
+        bottom = np.where(finite, (height - 1) - np.round((lo - vmin) * scale), -1).astype(np.int64)
+        rows = np.arange(height)[:, None]
+        image[(rows >= top) & (rows <= bottom)] = LINE_COLOR
+    return f"P6 {width} {height} 255\n".encode('ascii') + image.tobytes()
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir: Optional[str] = None, size: Tuple[int, int] = THUMBNAIL_SIZE, max_workers: int = 2):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.size = size
+        self._memory = {} # key -> PPM バイト列
+        self._lock = threading.Lock()
+        self._max_workers, self._executor = max_workers, None # ワーカーは最初の submit で作る (shutdown 後も作り直す)
+
+    def _key(self, filepath: str) -> Optional[str]:
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return None
+        raw = f"{os.path.abspath(filepath)}|{st.st_mtime_ns}|{st.st_size}|{self.size[0]}x{self.size[1]}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + '.ppm')
+
+    def get(self, filepath: str) -> Optional[bytes]:
+        # キャッシュ済みならメモリまたはディスクから返す。未生成なら None (解析はしない)
+        key = self._key(filepath)
+        if key is None: return None
+        with self._lock:
+            data = self._memory.get(key)
+        if data is not None: return data
+        try:
+            with open(self._path(key), 'rb') as f: data = f.read()
+        except OSError:
+            return None
+        with self._lock: self._memory[key] = data
+        return data
+
+    def generate(self, filepath: str) -> Optional[bytes]:
+        data = self.get(filepath)
+        if data is not None: return data
+        key = self._key(filepath)
+        if key is None: return None
+        angles, intensities = data_analyzer.parse_ras_file(filepath)
+        if intensities is None: return None
+        data = render_sparkline(intensities, self.size)
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f: f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass # キャッシュに書けなくてもサムネイル自体は返す
+        with self._lock: self._memory[key] = data
+        return data
+
+    def submit(self, filepath: str) -> Future:
+        # バックグラウンドで生成する。結果 (PPM バイト列または None) は Future で受け取る
+        with self._lock:
+            if self._executor is None: self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='xrd-thumbnail')
+            return self._executor.submit(self.generate, filepath)
+
+    def shutdown(self):
+        # キューに残った生成を取り消す。ThreadPoolExecutor はインタープリタ終了時にキューを全部実行するまで
+        # 待つので、終了前に必ず呼ぶ (実行中の生成だけは完了を待つ)
+        with self._lock: executor, self._executor = self._executor, None
+        if executor is not None: executor.shutdown(wait=False, cancel_futures=True)